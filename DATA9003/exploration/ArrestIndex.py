@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from DATA9003.misc.projection import ProjectCoords
+
+
+# OBJECT TYPE: Class
+# NAME:  ArrestIndex
+# DESCRIPTION:  Index of the cleaned arrests data, built once and queried many times without scanning every row
+#               Arrests are stored in date order so any time range is a block of rows found by binary search
+#               Box & polygon queries use lat/long, radius queries use distances in ft
+#               Rows for each value of the grouping columns are stored so offence/borough/year filters are lookups
+#               Can be passed in place of the arrests DataFrame to the hotspot and plotting functions
+
+class ArrestIndex:
+    # steps to build the index from the cleaned arrests data
+    def __init__(self, arrests_df, groups=("arrest_boro", "ofns_type", "ofns_desc", "year", "quarter", "month")):
+        # sort arrests by date (keeping the original order of arrests on the same day)
+        order = np.argsort(arrests_df["arrest_date"].values, kind="stable")
+        self.data = arrests_df.iloc[order]
+        self.dates = self.data["arrest_date"].values.astype("datetime64[ns]")
+
+        # spatial indices in lat/long (for boxes and polygons) and ft (for distances)
+        self.latitude = self.data["latitude"].values.astype(float)
+        self.longitude = self.data["longitude"].values.astype(float)
+        self.degtree = cKDTree(np.column_stack([self.longitude, self.latitude]))
+
+        x, y = ProjectCoords(self.latitude, self.longitude)
+        self.foottree = cKDTree(np.column_stack([x, y]))
+
+        # rows (in date order) for each value of the grouping columns
+        self.groups = {}
+        for col in groups:
+            if col not in self.data.columns:
+                continue
+
+            codes, values = pd.factorize(self.data[col], sort=True)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+
+            self.groups[col] = {value: order[bounds[k]:bounds[k + 1]] for k, value in enumerate(values.tolist())}
+
+    def __len__(self):
+        return len(self.data)
+
+    # function to get the block of rows between two dates (start included, end excluded)
+    def timerange(self, start=None, end=None):
+        lwr = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+        upr = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end), "ns"), side="left")
+
+        return lwr, max(lwr, upr)
+
+    # function to get the rows in a box of lat/long (south, west, north, east)
+    def inbox(self, bbox):
+        south, west, north, east = bbox
+
+        # search the square around the centre of the box that contains it then remove rows outside the box
+        centre = [(west + east) / 2, (south + north) / 2]
+        reach = max(east - west, north - south) / 2
+        rows = np.sort(self.degtree.query_ball_point(centre, reach, p=np.inf)).astype(int)
+
+        inside = ((self.latitude[rows] >= south) & (self.latitude[rows] <= north)
+                  & (self.longitude[rows] >= west) & (self.longitude[rows] <= east))
+
+        return rows[inside]
+
+    # function to get the rows within a distance (ft) of a (lat, long) point
+    def inradius(self, latitude, longitude, radius):
+        x, y = ProjectCoords([latitude], [longitude])
+        rows = self.foottree.query_ball_point([x[0], y[0]], radius)
+
+        return np.sort(rows).astype(int)
+
+    # function to get the rows inside a shapely polygon (in lat/long)
+    def inpolygon(self, polygon):
+        west, south, east, north = polygon.bounds
+        rows = self.inbox((south, west, north, east))
+
+        inside = shapely.contains_xy(polygon, self.longitude[rows], self.latitude[rows])
+
+        return rows[inside]
+
+    # function to get the rows (in date order) matching all of the given conditions
+    # radius = (lat, long, distance in ft), filters = {column: value} or {column: [list of values]} as for FilterArrests
+    def rows(self, bbox=None, radius=None, polygon=None, start=None, end=None, filters=None):
+        lwr, upr = self.timerange(start, end)
+
+        # candidate rows from spatial conditions (None => no spatial condition)
+        rows = None
+        for cond in [None if bbox is None else self.inbox(bbox),
+                     None if radius is None else self.inradius(*radius),
+                     None if polygon is None else self.inpolygon(polygon)]:
+            if cond is not None:
+                cond = cond[(cond >= lwr) & (cond < upr)]
+                rows = cond if rows is None else np.intersect1d(rows, cond, assume_unique=True)
+
+        # indexed filters, keeping only rows in the time range of each group
+        unindexed = {}
+        for col, values in (filters or {}).items():
+            if col not in self.groups:
+                unindexed[col] = values
+                continue
+
+            grouprows = []
+            for value in np.atleast_1d(values).tolist():
+                group = self.groups[col].get(value, np.empty(0, dtype=int))
+                grouprows.append(group[np.searchsorted(group, lwr):np.searchsorted(group, upr)])
+            grouprows = np.sort(np.concatenate(grouprows))
+
+            rows = grouprows if rows is None else np.intersect1d(rows, grouprows, assume_unique=True)
+
+        if rows is None:
+            rows = np.arange(lwr, upr)
+
+        # any other filters are checked on the remaining rows only
+        for col, values in unindexed.items():
+            rows = rows[self.data[col].iloc[rows].isin(np.atleast_1d(values)).values]
+
+        return rows
+
+    # function to count the arrests matching all of the given conditions
+    def count(self, bbox=None, radius=None, polygon=None, start=None, end=None, filters=None):
+        filters = filters or {}
+
+        # a time range and a filter on one indexed column can be counted by binary search alone
+        if (bbox is None) and (radius is None) and (polygon is None) and (len(filters) <= 1) and all(col in self.groups for col in filters):
+            lwr, upr = self.timerange(start, end)
+            if not filters:
+                return upr - lwr
+
+            col, values = next(iter(filters.items()))
+            total = 0
+            for value in np.atleast_1d(values).tolist():
+                group = self.groups[col].get(value, np.empty(0, dtype=int))
+                total += np.searchsorted(group, upr) - np.searchsorted(group, lwr)
+
+            return int(total)
+
+        return len(self.rows(bbox, radius, polygon, start, end, filters))
+
+    # function to get the arrests matching all of the given conditions as a DataFrame
+    def frame(self, bbox=None, radius=None, polygon=None, start=None, end=None, filters=None):
+        if (bbox is None) and (radius is None) and (polygon is None) and (start is None) and (end is None) and not filters:
+            return self.data
+
+        return self.data.iloc[self.rows(bbox, radius, polygon, start, end, filters)]
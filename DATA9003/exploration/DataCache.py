@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# schemas for the cached tables
+# the version number must be increased whenever the columns or dtypes of a table change so old caches are rebuilt
+ArrestsSchema = {"name": "arrests",
+                 "version": 4,
+                 "dtypes": {"arrest_key": "int64",
+                            "arrest_date": "datetime64[ns]",
+                            "arrest_boro": "category",
+                            "perp_race": "category",
+                            "latitude": "float32",
+                            "longitude": "float32",
+                            "year": "int16",
+                            "quarter": "int16",
+                            "month": "int16",
+                            "ofns_type": "category",
+                            "ofns_desc": "category",
+                            "zipcode": "int32",
+                            "OBJECTID": "int32"}}
+
+# nullable ints are used for columns that can be missing (e.g. properties that couldn't be matched to a census tract)
+# patterns give the dtypes of columns whose names depend on the data, e.g. the crime exposure columns (see CrimeExposure)
+SalesSchema = {"name": "sales",
+               "version": 5,
+               "dtypes": {"borough": "category",
+                          "zipcode": "int32",
+                          "land_sqft": "Int32",
+                          "gross_sqft": "Int32",
+                          "tax_cls": "category",
+                          "building_cls": "category",
+                          "sale_price": "int32",
+                          "sale_date": "datetime64[ns]",
+                          "latitude": "float32",
+                          "longitude": "float32",
+                          "OBJECTID": "Int32",
+                          "year": "int16",
+                          "age": "int16",
+                          "quarter": "int16",
+                          "month": "int16",
+                          "dist2school": "float32",
+                          "dist2park": "float32",
+                          "dist2sbwy": "float32",
+                          "dist2uni": "float32",
+                          "dist2shore": "float32",
+                          "dist2crime": "float32"},
+               "patterns": {r"n_\w+_\d+m_\d+mo": "Int32",
+                            r"idw_\w+_\d+m_\d+mo": "float32"}}
+
+# raw rows of a sales workbook, text columns are stored as strings whatever type Excel gave them
+IngestSchema = {"name": "ingest",
+                "version": 1,
+                "dtypes": {"neighbourhood": "string",
+                           "address": "string",
+                           "tax_cls": "string",
+                           "building_cls": "string",
+                           "sale_date": "datetime64[ns]"}}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: String
+# NAME:  CachePath
+# DESCRIPTION:  Get the path of the columnar cache for a CSV file
+
+def CachePath(filepath):
+    return os.path.splitext(filepath)[0] + ".parquet"
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary (or None)
+# NAME:  SourceKey
+# DESCRIPTION:  Get a key identifying a version of a file (path, size and modification time) and the settings used to make a cache of it
+#               Returns None if the file doesn't exist
+
+def SourceKey(filepath, **settings):
+    if not os.path.exists(filepath):
+        return None
+
+    stat = os.stat(filepath)
+    return {"source": os.path.abspath(filepath),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "settings": settings}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  SchemaDtypes
+# DESCRIPTION:  Get the dtype of each of the columns listed in a schema, either by name or by matching one of its patterns
+
+def SchemaDtypes(schema, columns):
+    dtypes = {}
+    for col in columns:
+        if col in schema["dtypes"]:
+            dtypes[col] = schema["dtypes"][col]
+            continue
+
+        for pattern, dtype in schema.get("patterns", {}).items():
+            if re.fullmatch(pattern, col):
+                dtypes[col] = dtype
+                break
+
+    return dtypes
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  ApplySchema
+# DESCRIPTION:  Convert the columns of a DataFrame to the dtypes listed in a schema
+#               The categories of categorical columns are the values present (sorted), so dtypes don't depend on how the data was loaded
+
+def ApplySchema(mydf, schema):
+    for col, dtype in SchemaDtypes(schema, mydf.columns).items():
+
+        if dtype.startswith("datetime64"):
+            mydf[col] = pd.to_datetime(mydf[col]).astype(dtype)
+        elif dtype == "category":
+            values = mydf[col].astype("category").cat.remove_unused_categories()
+            mydf[col] = values.cat.reorder_categories(sorted(values.cat.categories))
+        else:
+            mydf[col] = mydf[col].astype(dtype)
+
+    return mydf
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  CsvDtypes
+# DESCRIPTION:  Get the dtypes of a schema in the form used by pd.read_csv (dates are parsed separately)
+#               Columns that older versions of the csv files store differently can be excluded
+#               If the columns of the csv file are given then columns matching the patterns of the schema are included
+
+def CsvDtypes(schema, exclude=(), columns=None):
+    dtypes = schema["dtypes"] if columns is None else SchemaDtypes(schema, columns)
+
+    return {col: dtype for col, dtype in dtypes.items()
+            if not dtype.startswith("datetime64") and col not in exclude}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  MemoryReport
+# DESCRIPTION:  Get the memory used by each column of a DataFrame (in MB, including the contents of string columns)
+#               If baseline (e.g. the same data with default dtypes) is given, its memory use is also shown for comparison
+
+def MemoryReport(mydf, baseline=None):
+    report = pd.DataFrame({"dtype": mydf.dtypes.astype(str),
+                           "MB": mydf.memory_usage(index=False, deep=True) / 2**20})
+
+    if baseline is not None:
+        report["baseline dtype"] = baseline.dtypes.astype(str)
+        report["baseline MB"] = baseline.memory_usage(index=False, deep=True) / 2**20
+        report["factor"] = report["baseline MB"] / report["MB"]
+
+    report.loc["TOTAL"] = report.sum(numeric_only=True)
+    report = report.fillna({"dtype": ""})
+    if baseline is not None:
+        report.loc["TOTAL", "factor"] = report.loc["TOTAL", "baseline MB"] / report.loc["TOTAL", "MB"]
+        report = report.fillna({"baseline dtype": ""})
+
+    return report.round(2)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  WriteCache
+# DESCRIPTION:  Write a DataFrame to a parquet file, recording the name and version of its schema in the file metadata
+#               A key (e.g. the path, size and modification time of the source file) can also be recorded
+
+def WriteCache(mydf, filepath, schema, key=None):
+    table = pa.Table.from_pandas(mydf, preserve_index=False)
+
+    # add schema details to the metadata written by pandas
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"DATA9003"] = json.dumps({"name": schema["name"],
+                                        "version": schema["version"],
+                                        "key": key}).encode()
+
+    pq.write_table(table.replace_schema_metadata(metadata), filepath)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary (or None)
+# NAME:  ReadCacheKey
+# DESCRIPTION:  Get the key recorded in a parquet file written by WriteCache (None if the file doesn't exist or has no key)
+
+def ReadCacheKey(filepath):
+    if not os.path.exists(filepath):
+        return None
+
+    metadata = pq.read_schema(filepath).metadata or {}
+    if b"DATA9003" not in metadata:
+        return None
+
+    return json.loads(metadata[b"DATA9003"]).get("key")
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame (or None)
+# NAME:  ReadCache
+# DESCRIPTION:  Read (some columns of) a parquet file written by WriteCache
+#               Returns None if the file doesn't exist or was written using a different version of the schema (or key)
+#               filters (a pyarrow expression) are applied while reading so rows that fail them are never loaded
+
+def ReadCache(filepath, schema, columns=None, key=None, filters=None):
+    if not os.path.exists(filepath):
+        return None
+
+    # check the schema version before reading any data
+    metadata = pq.read_schema(filepath).metadata or {}
+    if b"DATA9003" not in metadata:
+        return None
+
+    cacheinfo = json.loads(metadata[b"DATA9003"])
+    if (cacheinfo["name"] != schema["name"]) or (cacheinfo["version"] != schema["version"]):
+        print("{} is out of date (schema version {}, expected {})".format(filepath,
+                                                                          cacheinfo["version"],
+                                                                          schema["version"]))
+        return None
+
+    # compare keys as they are stored (e.g. tuples are stored as lists)
+    if cacheinfo.get("key") != json.loads(json.dumps(key)):
+        print("{} is out of date (source file or settings have changed)".format(filepath))
+        return None
+
+    # parquet only keeps categories of text columns (e.g. an int borough column is read back as int)
+    return ApplySchema(pq.read_table(filepath, columns=columns, filters=filters).to_pandas(), schema)
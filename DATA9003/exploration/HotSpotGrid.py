@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from scipy.signal import fftconvolve
+
+from DATA9003.exploration.LoadArrests import FilterArrests
+from DATA9003.misc.projection import ProjectCoords, UnprojectCoords
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array + Numpy Array (x2)
+# NAME:  ArrestGrid
+# DESCRIPTION:  Count the number of arrests in each cell of a regular grid (cellsize in ft)
+#               Returns the grid of counts & the x and y coords of the cell centres
+
+def ArrestGrid(arrests_df, cellsize=500):
+    x, y = ProjectCoords(arrests_df["latitude"], arrests_df["longitude"])
+
+    # cell edges covering all arrests
+    xedges = np.arange(np.floor(x.min() / cellsize), np.floor(x.max() / cellsize) + 2) * cellsize
+    yedges = np.arange(np.floor(y.min() / cellsize), np.floor(y.max() / cellsize) + 2) * cellsize
+
+    counts, xedges, yedges = np.histogram2d(x, y, bins=[xedges, yedges])
+
+    return counts, xedges[:-1] + cellsize/2, yedges[:-1] + cellsize/2
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  GridKernel
+# DESCRIPTION:  Build a smoothing kernel on the grid, either gaussian (sd = bandwidth) or a disk of radius bandwidth
+
+def GridKernel(cellsize, bandwidth, kind="gaussian"):
+    if kind == "gaussian":
+        reach = int(np.ceil(3 * bandwidth / cellsize))
+    else:
+        reach = int(np.floor(bandwidth / cellsize))
+
+    offsets = np.arange(-reach, reach + 1) * cellsize
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    dist2 = dx ** 2 + dy ** 2
+
+    if kind == "gaussian":
+        kernel = np.exp(-dist2 / (2 * bandwidth ** 2))
+        kernel = kernel / kernel.sum()
+    else:
+        kernel = (dist2 <= bandwidth ** 2).astype(float)
+
+    return kernel
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  HotSpots_grid
+# DESCRIPTION:  Determine arrest hotspots on a regular grid (cellsize & bandwidth in ft)
+#               method = "kde":     smooth counts with a gaussian kernel, hotspots are cells above the given quantile of density
+#               method = "gistar":  Getis-Ord Gi* statistic using all cells within bandwidth, hotspots are cells with z > zcrit
+#               Arrests can be filtered first (e.g. filters={"year": 2015, "ofns_type": "Drugs"})
+#               The centres of hotspot cells can be used in place of hotspots_meso.json to calculate dist2crime
+
+def HotSpots_grid(arrests_df, method="kde", cellsize=500, bandwidth=1500, quantile=0.99, zcrit=1.96, filters=None):
+    mydf = FilterArrests(arrests_df, filters)
+
+    counts, xcentres, ycentres = ArrestGrid(mydf, cellsize)
+
+    if method == "kde":
+        # smoothed number of arrests in each cell
+        kernel = GridKernel(cellsize, bandwidth, kind="gaussian")
+        score = fftconvolve(counts, kernel, mode="same")
+
+        # cells with the highest densities (ignoring cells far from any arrest)
+        cutoff = np.quantile(score[score > 1e-9], quantile)
+        hot = score >= cutoff
+
+    elif method == "gistar":
+        kernel = GridKernel(cellsize, bandwidth, kind="disk")
+
+        # local sums of arrests & weights (number of cells within bandwidth, fewer at the edge of the grid)
+        localsum = fftconvolve(counts, kernel, mode="same")
+        weights = fftconvolve(np.ones_like(counts), kernel, mode="same")
+
+        # Gi* z-scores (binary weights => sum of squared weights = sum of weights)
+        n = counts.size
+        xbar = counts.mean()
+        s = np.sqrt((counts ** 2).mean() - xbar ** 2)
+
+        score = (localsum - xbar * weights) / (s * np.sqrt((n * weights - weights ** 2) / (n - 1)))
+        hot = score > zcrit
+
+    else:
+        raise ValueError("method should be 'kde' or 'gistar' but is '{}'".format(method))
+
+    # get lat and long of the centres of hotspot cells
+    xidx, yidx = np.nonzero(hot)
+    latitude, longitude = UnprojectCoords(xcentres[xidx], ycentres[yidx])
+
+    hotspots = pd.DataFrame({"latitude": latitude,
+                             "longitude": longitude,
+                             "count": counts[xidx, yidx],
+                             "score": score[xidx, yidx]})
+
+    hotspots.sort_values("score",
+                         ascending=False,
+                         inplace=True,
+                         ignore_index=True)
+
+    return hotspots
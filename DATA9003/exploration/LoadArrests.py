@@ -3,14 +3,23 @@ import json
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-import geopandas as gpd
-from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import ArcGIS
 import os
 import numpy as np
 import ast
+import heapq
+import hashlib
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from importlib import resources
+from sklearn.neighbors import KDTree
 from DATA9003 import assets
+from DATA9003.exploration.Periods import QuarterCode, MonthCode, AddPeriods
+from DATA9003.misc.regions import loadregions, loadtractpoints, regionindex, assignregions
+from DATA9003.misc.geocoding import geocodequeries
+from DATA9003.exploration.DataCache import ArrestsSchema, ApplySchema, CsvDtypes, MemoryReport, CachePath, SourceKey, ReadCacheKey, ReadCache, WriteCache
 
 
 # OBJECT TYPE: Function
@@ -165,17 +174,12 @@ def GetStationCoords(mydir):
                 "Address": "155-09 Jewel Avenue, Queens, NY, US"}
         myDF = myDF.append(SA_9, ignore_index=True)
 
-        # geocode addresses
+        # geocode addresses (addresses in the geocoding cache are not geocoded again)
         locator = ArcGIS(user_agent="nypdprecinct")
+        coords = geocodequeries(myDF["Address"], geocoder=locator, rate=10)
 
-        # 1 - incorporate delay between geocoding calls (avoid usage limits)
-        geocode = RateLimiter(locator.geocode, min_delay_seconds=0.1)
-
-        # 2- - create location column
-        myDF['location'] = myDF['Address'].apply(geocode)
-
-        # 3 - get long, lat and alt from location column (returns tuple)
-        myDF['point'] = myDF['location'].apply(lambda loc: tuple(loc.point) if loc else None)
+        # get lat, long and alt (returns tuple)
+        myDF['point'] = [(lat, lon, 0.0) if not np.isnan(lat) else None for lat, lon in coords.values]
 
         # save to file to avoid having to repeat geocoding
         myDF.to_csv(filepath, index=False)
@@ -184,244 +188,893 @@ def GetStationCoords(mydir):
 
 
 # OBJECT TYPE: Function
-# RETURN TYPE: Pandas DataFrame
-# NAME:  LoadArrestsData
-# DESCRIPTION:  Load and clean the NYPD arrests dataset
+# RETURN TYPE: Scikit-Learn KDTree
+# NAME:  StationTree
+# DESCRIPTION:  Build a spatial index over the (lat, long) coords of the stations returned by GetStationCoords
+#               The chebyshev metric means a query radius describes the same square tolerance box used by OffBy
 
-def LoadArrestsData(CrimeDir, SourceFile, NewFile):
-    filepath = os.path.join(CrimeDir, NewFile)
+def StationTree(precincts):
+    coords = np.array([station[:2] for station in precincts.point])
+
+    return KDTree(coords, metric="chebyshev")
 
-    if os.path.exists(filepath):
-        arrests_df = pd.read_csv(filepath)
 
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array (Boolean) + Pandas Series
+# NAME:  NearStation
+# DESCRIPTION:  Flag every arrest made within some tolerance of a station and count the arrests suppressed by each station
+#               Counts can be used to tune the tolerance (within) without rerunning the full cleaning process
+
+def NearStation(arrests_df, precincts, within=0.002, tree=None):
+    # stations that could not be geocoded can't be matched
+    precincts = precincts.loc[precincts.point.notna()]
+
+    if tree is None:
+        tree = StationTree(precincts)
+
+    # query the nearest station to every arrest in a single call
+    coords = arrests_df[["latitude", "longitude"]].values
+    if len(coords) > 0:
+        distance, index = tree.query(coords, k=1)
+        distance = distance.flatten()
+        index = index.flatten()
     else:
+        distance = np.zeros(0)
+        index = np.zeros(0, dtype=int)
 
-        # columns to use
-        cols = ["ARREST_KEY",
-                "ARREST_DATE",
-                "LAW_CODE",
-                "ARREST_BORO",
-                "PERP_RACE",
-                "Latitude",
-                "Longitude"]
+    # an arrest is within the tolerance box of its nearest station if the largest coord difference is small enough
+    nearby = distance <= within
 
-        # read file
-        arrests_df = pd.read_csv(os.path.join(CrimeDir, SourceFile),
-                                 usecols=cols)
+    # count the arrests attributed to each station
+    suppressed = np.bincount(index[nearby],
+                             minlength=len(precincts))
+    suppressed = pd.Series(suppressed,
+                           index=precincts["Precinct"].values,
+                           name="suppressed")
 
-        arrests_df.dropna(inplace=True)
+    return nearby, suppressed
 
-        # make column names lowercase
-        arrests_df.columns = [name.lower() for name in cols]
 
-        # change columns to appropriate type
-        arrests_df["law_code"] = arrests_df["law_code"].astype("string")
-        arrests_df['arrest_date'] = pd.to_datetime(arrests_df["arrest_date"], format="%m/%d/%Y")
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  CompileArticles
+# DESCRIPTION:  Convert the article numbers listed in ArticleNumbers.json to sorted lookup arrays
+#               Where offence types overlap, types listed later take precedence (as do later descriptions)
 
-        # filter for violations of Penal Law only
-        arrests_df = arrests_df.loc[arrests_df["law_code"].str.startswith("PL ")]
+def CompileArticles(lawdict):
+    # offence types in the order they are listed, "-" denotes an unclassified article
+    types = ["-"] + list(lawdict.keys())
 
-        # extract year from date
-        arrests_df["year"] = arrests_df["arrest_date"].dt.year
-        arrests_df = arrests_df.loc[arrests_df.year < 2021]
+    # each offence type covers the (closed) range of its article numbers
+    lwr = np.array([min(lawdict[ofns_type].values()) for ofns_type in types[1:]])
+    upr = np.array([max(lawdict[ofns_type].values()) for ofns_type in types[1:]]) + 1
 
-        # extract quarter from date
-        arrests_df["quarter"] = arrests_df["arrest_date"].dt.quarter
-        arrests_df["quarter"] = "Q" + arrests_df["quarter"].astype(str) + "-" + arrests_df["year"].astype(str)
+    # split the number line into intervals that begin at each bound & find the offence type for each interval
+    bounds = np.unique(np.concatenate([lwr, upr]))
+    type_codes = np.zeros(len(bounds), dtype=int)
 
-        # extract month from date
-        arrests_df["month"] = arrests_df["arrest_date"].dt.month
-        arrests_df["month"] = arrests_df["month"].astype(str) + "/" + arrests_df["year"].astype(str)
+    for code in range(1, len(types)):
+        cond = (lwr[code - 1] <= bounds) & (bounds < upr[code - 1])
+        type_codes[cond] = code
 
-        # Extract article number from law code
-        arrests_df["law_code"] = arrests_df["law_code"].str.replace("PL ", "")
-        arrests_df["article"] = arrests_df["law_code"].str.slice(0, 3).astype(int)
-        arrests_df.drop(["law_code"], axis=1, inplace=True)
+    # map each article number to an offence description
+    descdict = {}
+    for ofns_type in lawdict.keys():
+        for ofns_desc, article in lawdict[ofns_type].items():
+            descdict[article] = ofns_desc
 
-        arrests_df["ofns_type"] = "-"
-        arrests_df["ofns_desc"] = "-"
+    descs = ["-"] + list(dict.fromkeys(descdict.values()))
+    desc_index = {ofns_desc: code for code, ofns_desc in enumerate(descs)}
 
-        # read in article numbers
-        with resources.open_text(assets, "ArticleNumbers.json") as jsonfile:
-            lawdict = json.load(jsonfile)
+    articles = np.array(sorted(descdict.keys()))
+    desc_codes = np.array([desc_index[descdict[article]] for article in articles])
 
-        # classify offense type and description using article numbers
-        for ofns_type in lawdict.keys():
+    return {"types": types,
+            "bounds": bounds,
+            "type_codes": type_codes,
+            "descs": descs,
+            "articles": articles,
+            "desc_codes": desc_codes}
 
-            key_min = min(lawdict[ofns_type], key=lawdict[ofns_type].get)
-            key_max = max(lawdict[ofns_type], key=lawdict[ofns_type].get)
 
-            cond1a = lawdict[ofns_type][key_min] <= arrests_df["article"]
-            cond1b = arrests_df["article"] <= lawdict[ofns_type][key_max]
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Categorical (x2)
+# NAME:  ClassifyArticles
+# DESCRIPTION:  Label article numbers with an offence type and description using the arrays built by CompileArticles
 
-            arrests_df.loc[(cond1a) & (cond1b), "ofns_type"] = ofns_type
+def ClassifyArticles(article, classifier):
+    article = np.asarray(article)
 
-            for ofns_desc in lawdict[ofns_type].keys():
-                cond2 = arrests_df["article"] == lawdict[ofns_type][ofns_desc]
-                arrests_df.loc[cond2, "ofns_desc"] = ofns_desc
+    # find the interval containing each article number
+    pos = np.searchsorted(classifier["bounds"], article, side="right") - 1
+    type_codes = np.where(pos >= 0,
+                          classifier["type_codes"][pos.clip(0)],
+                          0)
 
-        # remove article number - no longer required
-        arrests_df.drop(["article"], axis=1, inplace=True)
+    # find exact matches for each article number
+    articles = classifier["articles"]
+    pos = np.searchsorted(articles, article).clip(0, len(articles) - 1)
+    desc_codes = np.where(articles[pos] == article,
+                          classifier["desc_codes"][pos],
+                          0)
 
-        # exploration revealed some offence types seldom occur => treat as removable outliers
-        out1 = arrests_df["ofns_type"] != "Anticipatory"
-        out2 = arrests_df["ofns_type"] != "Family/Child Welfare"
-        out3 = arrests_df["ofns_type"] != "Firearms/Fireworks/Pornography/Gambling"
-        out4 = arrests_df["ofns_type"] != "Fraud"
-        out5 = arrests_df["ofns_type"] != "Organised Crime"
-        out6 = arrests_df["ofns_type"] != "Terrorism"
+    ofns_type = pd.Categorical.from_codes(type_codes, categories=classifier["types"])
+    ofns_desc = pd.Categorical.from_codes(desc_codes, categories=classifier["descs"])
 
-        arrests_df = arrests_df.loc[(out1) & (out2) & (out3) & (out4) & (out5) & (out6)]
+    return ofns_type, ofns_desc
 
-        # filter out arrests made at police stations
 
-        # read in locations of stations
-        precincts = GetStationCoords(CrimeDir)
+# columns of the source file to use
+ArrestCols = ["ARREST_KEY",
+              "ARREST_DATE",
+              "LAW_CODE",
+              "ARREST_BORO",
+              "PERP_RACE",
+              "Latitude",
+              "Longitude"]
 
-        # if an arrest was made near one of these location change coords to (0,0)
-        for station in precincts.point:
-            cond_A = arrests_df["latitude"].apply(OffBy, args=[station[0]])
-            cond_B = arrests_df["longitude"].apply(OffBy, args=[station[1]])
 
-            arrests_df.loc[(cond_A) & (cond_B), "latitude"] = 0
-            arrests_df.loc[(cond_A) & (cond_B), "longitude"] = 0
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  ArrestAssets
+# DESCRIPTION:  Load the assets needed to clean the NYPD arrests dataset (article numbers, stations and GIS data)
 
-        # treat coord 0 as NaN + remove
-        arrests_df["latitude"].replace(0, np.nan, inplace=True)
-        arrests_df["longitude"].replace(0, np.nan, inplace=True)
+def ArrestAssets(CrimeDir):
+    # read in article numbers
+    with resources.open_text(assets, "ArticleNumbers.json") as jsonfile:
+        lawdict = json.load(jsonfile)
 
-        # use coords to match arrests to zipcode
-        arrests_df = gpd.GeoDataFrame(arrests_df,
-                                      geometry=gpd.points_from_xy(arrests_df.longitude, arrests_df.latitude))
+    # read in locations of stations
+    precincts = GetStationCoords(CrimeDir)
+    precincts = precincts.loc[precincts.point.notna()]
 
-        # set coord reference system to EPSG:4326
-        arrests_df.set_crs(epsg=4326, inplace=True)
+    return {"classifier": CompileArticles(lawdict),
+            "precincts": precincts,
+            "stationtree": StationTree(precincts),
+            "regions": regionindex()}
 
-        # read in GIS data for zipcodes
-        with resources.path(assets, "zipcodes.zip") as zipfile:
-            zipcodes = gpd.read_file(zipfile)
-            zipcodes.columns = [name.lower() for name in zipcodes.columns]
-            zipcodes = zipcodes[["zipcode", "geometry"]]
-            zipcodes.to_crs(epsg=4326, inplace=True)
 
-        # match arrest coords to zipcodes
-        arrests_df = gpd.sjoin(arrests_df,
-                               zipcodes,
-                               how="left",
-                               op="within")
-
-        arrests_df.dropna(inplace=True)
-        arrests_df.drop(["index_right"],
-                        axis=1,
-                        inplace=True)
-
-        # read in census tract GIS data
-        with resources.path("DATA9003.assets", "censustracts.geojson") as censusfile:
-            census = gpd.read_file(censusfile)
-            census = census[["OBJECTID", "geometry"]]
-            census.to_crs(epsg=4326, inplace=True)
-
-        # match arrest coords to census tract
-        arrests_df = gpd.sjoin(arrests_df,
-                               census,
-                               how="left",
-                               op="within")
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame + Pandas Series
+# NAME:  CleanArrests
+# DESCRIPTION:  Clean rows read from the NYPD arrests dataset
+#               Every step acts on rows independently, so the data can be cleaned all at once or in chunks
+#               Arrests made in endyear or later are removed (unless endyear is None)
+
+def CleanArrests(arrests_df, myassets, within=0.002, endyear=2021):
+    arrests_df = arrests_df.dropna()
+
+    # make column names lowercase
+    arrests_df.columns = [name.lower() for name in ArrestCols]
+
+    # change columns to appropriate type
+    arrests_df["arrest_key"] = arrests_df["arrest_key"].astype("int64")
+    arrests_df["law_code"] = arrests_df["law_code"].astype("string")
+    arrests_df['arrest_date'] = pd.to_datetime(arrests_df["arrest_date"], format="%m/%d/%Y")
+
+    # filter for violations of Penal Law only
+    arrests_df = arrests_df.loc[arrests_df["law_code"].str.startswith("PL ")]
+
+    # extract year from date
+    arrests_df["year"] = arrests_df["arrest_date"].dt.year
+    if endyear is not None:
+        arrests_df = arrests_df.loc[arrests_df.year < endyear]
+
+    # extract quarter & month from date (numbered on the same time axis as the sales data)
+    arrests_df["quarter"] = QuarterCode(arrests_df["arrest_date"])
+    arrests_df["month"] = MonthCode(arrests_df["arrest_date"])
+
+    # Extract article number from law code
+    arrests_df["law_code"] = arrests_df["law_code"].str.replace("PL ", "")
+    arrests_df["article"] = arrests_df["law_code"].str.slice(0, 3).astype(int)
+    arrests_df = arrests_df.drop(["law_code"], axis=1)
+
+    # classify offense type and description using article numbers
+    arrests_df["ofns_type"], arrests_df["ofns_desc"] = ClassifyArticles(arrests_df["article"], myassets["classifier"])
+
+    # remove article number - no longer required
+    arrests_df = arrests_df.drop(["article"], axis=1)
+
+    # exploration revealed some offence types seldom occur => treat as removable outliers
+    out1 = arrests_df["ofns_type"] != "Anticipatory"
+    out2 = arrests_df["ofns_type"] != "Family/Child Welfare"
+    out3 = arrests_df["ofns_type"] != "Firearms/Fireworks/Pornography/Gambling"
+    out4 = arrests_df["ofns_type"] != "Fraud"
+    out5 = arrests_df["ofns_type"] != "Organised Crime"
+    out6 = arrests_df["ofns_type"] != "Terrorism"
+
+    arrests_df = arrests_df.loc[(out1) & (out2) & (out3) & (out4) & (out5) & (out6)]
+
+    # filter out arrests made at police stations
+    # if an arrest was made near one of these location change coords to (0,0)
+    nearby, suppressed = NearStation(arrests_df,
+                                     myassets["precincts"],
+                                     within,
+                                     tree=myassets["stationtree"])
+    arrests_df.loc[nearby, "latitude"] = 0
+    arrests_df.loc[nearby, "longitude"] = 0
+
+    # treat coord 0 as NaN + remove
+    arrests_df["latitude"] = arrests_df["latitude"].replace(0, np.nan)
+    arrests_df["longitude"] = arrests_df["longitude"].replace(0, np.nan)
+
+    # use coords to match arrests to zipcode and census tract
+    regions = assignregions(arrests_df["latitude"],
+                            arrests_df["longitude"],
+                            myassets["regions"])
+
+    arrests_df["zipcode"] = regions["zipcode"].values
+    arrests_df["OBJECTID"] = regions["OBJECTID"].values
+    arrests_df = arrests_df.dropna()
+
+    # unmatched arrests leave the zipcodes and tract IDs as objects/floats
+    arrests_df["zipcode"] = arrests_df["zipcode"].astype("int64")
+    arrests_df["OBJECTID"] = arrests_df["OBJECTID"].astype("int64")
+
+    return arrests_df, suppressed
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  SortArrests
+# DESCRIPTION:  Sort arrests by date, arrests made on the same date keep the order of the source file
+
+def SortArrests(arrests_df):
+    arrests_df = arrests_df.sort_index(kind="mergesort")
+    arrests_df = arrests_df.sort_values("arrest_date",
+                                        kind="mergesort",
+                                        ignore_index=True)
+
+    return arrests_df
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: String
+# NAME:  SuppressedPath
+# DESCRIPTION:  Get the path of the file recording the arrests suppressed by each station when a cleaned file was made
+
+def SuppressedPath(filepath):
+    return os.path.splitext(filepath)[0] + "_suppressed.csv"
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  WriteSuppressed
+# DESCRIPTION:  Save the arrests suppressed by each station (see NearStation) alongside the cleaned file at filepath
+
+def WriteSuppressed(suppressed, filepath):
+    suppressed.to_csv(SuppressedPath(filepath), index_label="Precinct")
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series (or None)
+# NAME:  ReadSuppressed
+# DESCRIPTION:  Read the arrests suppressed by each station when the cleaned file at filepath was made (None if not recorded)
+
+def ReadSuppressed(filepath):
+    if not os.path.exists(SuppressedPath(filepath)):
+        return None
+
+    return pd.read_csv(SuppressedPath(filepath), index_col="Precinct")["suppressed"]
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  CleanedKeys
+# DESCRIPTION:  Get the arrest keys of the rows of the source file that go through cleaning (i.e. aren't cut off by endyear)
+#               Rows that are cleaned but rejected (e.g. other laws, station houses, missing coords) are included
+
+def CleanedKeys(chunk, endyear=None):
+    cleaned = chunk["ARREST_KEY"].notna()
+
+    if endyear is not None:
+        year = pd.to_datetime(chunk["ARREST_DATE"], format="%m/%d/%Y", errors="coerce").dt.year
+        cleaned = cleaned & ~(year >= endyear)
+
+    return chunk.loc[cleaned, "ARREST_KEY"].values.astype("int64")
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: String
+# NAME:  ProcessedPath
+# DESCRIPTION:  Get the path of the file recording the arrest keys of the source rows that have been cleaned for the cleaned file
+
+def ProcessedPath(filepath):
+    return os.path.splitext(filepath)[0] + "_processed.npy"
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  WriteProcessed
+# DESCRIPTION:  Save the arrest keys of the source rows that have been cleaned (kept or rejected) for the cleaned file at filepath
+
+def WriteProcessed(keys, filepath):
+    np.save(ProcessedPath(filepath), np.unique(np.asarray(keys, dtype="int64")))
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array (or None)
+# NAME:  ReadProcessed
+# DESCRIPTION:  Read the arrest keys of the source rows that have been cleaned for the cleaned file at filepath (None if not recorded)
+
+def ReadProcessed(filepath):
+    if not os.path.exists(ProcessedPath(filepath)):
+        return None
+
+    return np.load(ProcessedPath(filepath))
+
+
+# settings assumed for cleaned files with no record of the settings used (made before settings were recorded)
+DefaultSettings = {"within": 0.002,
+                   "endyear": 2021}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: String
+# NAME:  SettingsPath
+# DESCRIPTION:  Get the path of the file recording the settings (within & endyear) used to make a cleaned file
+
+def SettingsPath(filepath):
+    return os.path.splitext(filepath)[0] + "_settings.json"
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  WriteSettings
+# DESCRIPTION:  Save the settings used to make the cleaned file at filepath alongside it
+
+def WriteSettings(settings, filepath):
+    with open(SettingsPath(filepath), "w") as jsonfile:
+        json.dump(settings, jsonfile)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary (or None)
+# NAME:  ReadSettings
+# DESCRIPTION:  Read the settings used to make the cleaned file at filepath (None if not recorded)
+
+def ReadSettings(filepath):
+    if not os.path.exists(SettingsPath(filepath)):
+        return None
+
+    with open(SettingsPath(filepath), "r") as jsonfile:
+        return json.load(jsonfile)
+
+
+# assets used by the current worker process when cleaning arrests in parallel (see CleanChunks)
+_workerassets = None
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  InitWorker
+# DESCRIPTION:  Load the assets needed to clean the NYPD arrests dataset once per process
+
+def InitWorker(CrimeDir):
+    global _workerassets
+    _workerassets = ArrestAssets(CrimeDir)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame + Pandas Series
+# NAME:  CleanShard
+# DESCRIPTION:  Clean and sort a chunk of the NYPD arrests dataset using the assets loaded by InitWorker
+
+def CleanShard(chunk, within=0.002, endyear=2021):
+    chunk, suppressed = CleanArrests(chunk, _workerassets, within, endyear)
+
+    return SortArrests(chunk), suppressed
+
+
+# OBJECT TYPE: Generator
+# RETURN TYPE: Pandas DataFrame + Pandas Series + Numpy Array
+# NAME:  CleanChunks
+# DESCRIPTION:  Read the NYPD arrests dataset in chunks of (at most) chunksize rows and yield each chunk once cleaned & sorted
+#               The arrest keys of the source rows that went through cleaning (see CleanedKeys) are yielded with each chunk
+#               If workers is given then chunks are cleaned in parallel by a pool of that many processes
+#               Chunks are always yielded in the order they appear in the source file
+
+def CleanChunks(SourcePath, CrimeDir, within=0.002, chunksize=500000, endyear=2021, workers=None):
+    chunks = pd.read_csv(SourcePath,
+                         usecols=ArrestCols,
+                         chunksize=chunksize)
+
+    if workers is None:
+        InitWorker(CrimeDir)
+
+        for chunk in chunks:
+            keys = CleanedKeys(chunk, endyear)
+            yield CleanShard(chunk, within, endyear) + (keys,)
+
+    else:
+        # make sure any assets that need to be generated & saved are created before the workers start
+        GetStationCoords(CrimeDir)
+        loadregions()
 
-        arrests_df.dropna(inplace=True)
-        arrests_df.drop(["geometry", "index_right"],
-                        axis=1,
-                        inplace=True)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=InitWorker,
+                                 initargs=(CrimeDir,)) as pool:
 
-        # sort arrests by date
-        arrests_df.sort_values("arrest_date",
-                               inplace=True,
+            # limit the number of chunks waiting to be cleaned so that memory use stays bounded
+            pending = deque()
+
+            for chunk in chunks:
+                pending.append((pool.submit(CleanShard, chunk, within, endyear), CleanedKeys(chunk, endyear)))
+
+                if len(pending) >= 2*workers:
+                    future, keys = pending.popleft()
+                    yield future.result() + (keys,)
+
+            while len(pending) > 0:
+                future, keys = pending.popleft()
+                yield future.result() + (keys,)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series + Numpy Array
+# NAME:  StreamArrests
+# DESCRIPTION:  Clean the NYPD arrests dataset in chunks of (at most) chunksize rows and write the results to OutPath
+#               Each cleaned chunk is sorted and written to a temporary file, the files are then merged by date
+#               Output is identical to cleaning the whole file at once but only a few chunks are held in memory
+#               Returns the arrests suppressed by each station & the arrest keys of the source rows that went through cleaning
+
+def StreamArrests(SourcePath, OutPath, CrimeDir, within=0.002, chunksize=500000, endyear=2021, workers=None):
+    rundir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(OutPath)))
+    runpaths = []
+    suppressed = 0
+    keys = []
+
+    try:
+        # clean each chunk and write the sorted results to file
+        for chunk, chunk_suppressed, chunk_keys in CleanChunks(SourcePath, CrimeDir, within, chunksize, endyear, workers):
+            suppressed = suppressed + chunk_suppressed
+            keys.append(chunk_keys)
+
+            runpath = os.path.join(rundir, "run{}.csv".format(len(runpaths)))
+            chunk.to_csv(runpath, index=False)
+            runpaths.append(runpath)
+            del chunk
+
+        # merge the sorted chunks line-by-line, ties are taken from earlier chunks first
+        runfiles = [open(runpath, "r", newline="") for runpath in runpaths]
+        try:
+            header = [runfile.readline() for runfile in runfiles][0]
+            datecol = header.rstrip("\r\n").split(",").index("arrest_date")
+
+            def getdate(line):
+                return line.split(",", datecol + 1)[datecol]
+
+            with open(OutPath, "w", newline="") as outfile:
+                outfile.write(header)
+                outfile.writelines(heapq.merge(*runfiles, key=getdate))
+        finally:
+            for runfile in runfiles:
+                runfile.close()
+
+    finally:
+        shutil.rmtree(rundir)
+
+    return suppressed, np.concatenate(keys + [np.zeros(0, dtype="int64")])
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame + Pandas Series
+# NAME:  UpdateArrests
+# DESCRIPTION:  Add arrests from the source file that haven't been cleaned for the cleaned file at filepath
+#               Only rows with new arrest keys are cleaned, these are then merged with the cleaned data in date order
+#               The keys of source rows already cleaned (including rows cleaning rejected) are recorded alongside the cleaned file,
+#               if they weren't recorded (e.g. older files) then the keys in the cleaned file are used instead
+#               Rows cut off by endyear aren't recorded so they are added by a later update without a cutoff (endyear = None)
+#               The arrests suppressed by each station are added to those recorded for the cleaned file
+
+def UpdateArrests(SourcePath, filepath, myassets, within=0.002, chunksize=500000, endyear=None):
+    arrests_df = pd.read_csv(filepath,
+                             parse_dates=["arrest_date"])
+    arrests_df = AddPeriods(arrests_df, "arrest_date")
+
+    # keys of source rows that have already been cleaned
+    processed = ReadProcessed(filepath)
+    if processed is None:
+        print("{} has no record of the source rows cleaned, using the arrests it contains".format(filepath))
+        processed = arrests_df["arrest_key"].unique()
+
+    knownkeys = pd.Index(processed)
+
+    # read source file in chunks & keep only rows with new keys
+    newrows = []
+    chunks = pd.read_csv(SourcePath,
+                         usecols=ArrestCols,
+                         chunksize=chunksize)
+
+    for chunk in chunks:
+        newrows.append(chunk.loc[~chunk["ARREST_KEY"].isin(knownkeys)])
+
+    newrows = pd.concat(newrows)
+    print("{} rows of source file not yet cleaned for {}".format(len(newrows), filepath))
+
+    # clean new rows
+    newkeys = CleanedKeys(newrows, endyear)
+    newrows, suppressed = CleanArrests(newrows, myassets, within, endyear)
+    print("{} arrests made at station houses removed".format(suppressed.sum()))
+    print("{} new arrests added".format(len(newrows)))
+
+    previous = ReadSuppressed(filepath)
+    if previous is not None:
+        suppressed = suppressed.add(previous, fill_value=0).astype("int64")
+    WriteSuppressed(suppressed, filepath)
+
+    if len(newrows) > 0:
+        newrows = SortArrests(newrows)
+
+        # merge new arrests with cleaned data, arrests made on the same date are listed after the existing ones
+        arrests_df = pd.concat([arrests_df, newrows],
                                ignore_index=True)
+        arrests_df = arrests_df.sort_values("arrest_date",
+                                            kind="mergesort",
+                                            ignore_index=True)
 
-        # write to file to avoid having to repeat cleaning operations
         arrests_df.to_csv(filepath, index=False)
 
-    print(arrests_df.info())
+    WriteProcessed(np.concatenate([processed, newkeys]), filepath)
+
+    return arrests_df, suppressed
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame (+ Pandas Series)
+# NAME:  LoadArrestsData
+# DESCRIPTION:  Load and clean the NYPD arrests dataset
+#               If chunksize is given the source file is cleaned in chunks to limit memory use
+#               The cleaned data is cached in a parquet file alongside NewFile, columns can be used to load only some columns
+#               If update is True then arrests in the source file that haven't been cleaned for NewFile are cleaned and added
+#               endyear: arrests made in this year or later are removed, if None then loading NewFile keeps the cutoff it was
+#               cleaned with (2021 when cleaning from scratch) and updates add arrests from every year
+#               If workers is given the source file is split into shards which are cleaned in parallel
+#               If return_suppressed is True the arrests suppressed by each station are also returned (to help tune within)
+#               These are recorded when NewFile is made, None is returned if they weren't recorded (e.g. older files)
+#               The settings used to clean NewFile are recorded alongside it (files with no record are assumed to use DefaultSettings)
+#               The parquet cache is only used while NewFile is unchanged and within & endyear are the same as when it was written
+#               If NewFile was cleaned using a different within or endyear then the source file is cleaned again
+
+def LoadArrestsData(CrimeDir, SourceFile, NewFile, within=0.002, chunksize=None, columns=None, update=False, endyear=None, workers=None, return_suppressed=False):
+    filepath = os.path.join(CrimeDir, NewFile)
+    sourcepath = os.path.join(CrimeDir, SourceFile)
+    cachepath = CachePath(filepath)
+    suppressed = None
+
+    # settings used to clean the csv file, recorded alongside it
+    # older files only recorded them in the key of the cache (if the csv is unchanged), or not at all
+    madewith = ReadSettings(filepath) if os.path.exists(filepath) else None
+    if (madewith is None) and os.path.exists(filepath):
+        cachedkey = ReadCacheKey(cachepath)
+        filekey = SourceKey(filepath)
+        if (cachedkey is not None) and all(cachedkey.get(item) == filekey[item] for item in ["source", "size", "mtime"]):
+            madewith = cachedkey.get("settings")
+        else:
+            print("{} has no record of the settings used to clean it, assuming {}".format(filepath, DefaultSettings))
+            madewith = DefaultSettings
+        WriteSettings(madewith, filepath)
+
+    if (endyear is None) and not update:
+        endyear = 2021 if madewith is None else madewith.get("endyear")
+
+    # updates without a cutoff can add to a file cleaned with any cutoff
+    settings = {"within": within,
+                "endyear": endyear}
+    compared = ["within"] if update and (endyear is None) else ["within", "endyear"]
+    newsettings = (madewith is not None) and any(madewith.get(item) != settings[item] for item in compared)
+
+    # the cache mirrors this version of the csv file, cleaned using these settings
+    key = SourceKey(filepath, **settings)
+
+    if update or (key is None):
+        arrests_df = None
+    else:
+        arrests_df = ReadCache(cachepath, ArrestsSchema, columns, key=key)
+
+    if arrests_df is None:
+
+        if newsettings:
+            print("{} was cleaned using different settings ({}), cleaning again".format(filepath, madewith))
+
+        if update and os.path.exists(filepath) and not newsettings:
+            myassets = ArrestAssets(CrimeDir)
+
+            # clean new arrests only and add to file
+            arrests_df, suppressed = UpdateArrests(sourcepath, filepath, myassets, within, chunksize or 500000, endyear)
+
+        elif os.path.exists(filepath) and not newsettings:
+            arrests_df = pd.read_csv(filepath,
+                                     dtype=CsvDtypes(ArrestsSchema, exclude=["quarter", "month"]))
+
+            # files written by older versions label quarters/months with strings
+            arrests_df = AddPeriods(arrests_df, "arrest_date")
+
+        elif chunksize is not None:
+            # clean file in chunks and write to file to avoid having to repeat cleaning operations
+            suppressed, keys = StreamArrests(sourcepath, filepath, CrimeDir, within, chunksize, endyear, workers)
+            print("{} arrests made at station houses removed".format(suppressed.sum()))
+            WriteSuppressed(suppressed, filepath)
+            WriteProcessed(keys, filepath)
+
+            arrests_df = pd.read_csv(filepath)
+
+        elif workers is not None:
+            # clean file in parallel, shards are cleaned in order so the results can simply be concatenated
+            shards = []
+            suppressed = 0
+            keys = []
+            for shard, shard_suppressed, shard_keys in CleanChunks(sourcepath, CrimeDir, within, endyear=endyear, workers=workers):
+                shards.append(shard)
+                suppressed = suppressed + shard_suppressed
+                keys.append(shard_keys)
+            print("{} arrests made at station houses removed".format(suppressed.sum()))
+            WriteSuppressed(suppressed, filepath)
+            WriteProcessed(np.concatenate(keys + [np.zeros(0, dtype="int64")]), filepath)
+
+            # sort arrests by date, shards are already sorted & arrests made on the same date stay in shard order
+            arrests_df = pd.concat(shards, ignore_index=True)
+            arrests_df = arrests_df.sort_values("arrest_date",
+                                                kind="mergesort",
+                                                ignore_index=True)
+            del shards
+
+            # write to file to avoid having to repeat cleaning operations
+            arrests_df.to_csv(filepath, index=False)
+
+        else:
+            myassets = ArrestAssets(CrimeDir)
+
+            # read file
+            arrests_df = pd.read_csv(sourcepath,
+                                     usecols=ArrestCols)
+
+            keys = CleanedKeys(arrests_df, endyear)
+            arrests_df, suppressed = CleanArrests(arrests_df, myassets, within, endyear)
+            print("{} arrests made at station houses removed".format(suppressed.sum()))
+            WriteSuppressed(suppressed, filepath)
+            WriteProcessed(keys, filepath)
+
+            # sort arrests by date
+            arrests_df = SortArrests(arrests_df)
+
+            # write to file to avoid having to repeat cleaning operations
+            arrests_df.to_csv(filepath, index=False)
+
+        # record the settings used to clean the csv file
+        if update or (madewith is None) or newsettings:
+            WriteSettings(settings, filepath)
+
+        # write typed cache to avoid having to re-parse the csv file
+        arrests_df = ApplySchema(arrests_df, ArrestsSchema)
+        WriteCache(arrests_df, cachepath, ArrestsSchema, SourceKey(filepath, **settings))
+
+        if columns is not None:
+            arrests_df = arrests_df[columns]
+
+    if return_suppressed and (suppressed is None):
+        suppressed = ReadSuppressed(filepath)
+
+    print(MemoryReport(arrests_df))
+
+    if return_suppressed:
+        return arrests_df, suppressed
+
     return arrests_df
 
 
+# concentration curves computed by MicroCurve, keyed by a fingerprint of the arrest coords
+_microcurves = {}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  LocationKeys
+# DESCRIPTION:  Quantize (lat, long) pairs to a grid with spacing 10^-precision degrees and pack each pair into a single integer
+
+def LocationKeys(latitude, longitude, precision=6):
+    scale = 10 ** precision
+    lat = np.round(np.asarray(latitude, dtype=float) * scale).astype(np.int64)
+    lon = np.round(np.asarray(longitude, dtype=float) * scale).astype(np.int64)
+
+    # latitude in the upper 32 bits, (offset) longitude in the lower 32 bits
+    return lat * 2**32 + (lon + 2**31)
+
+
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
+# NAME:  MicroCurve
+# DESCRIPTION:  Count the arrests at each location and sort locations by count to get the concentration curve of arrests
+#               Curves are cached so repeated calls for the same arrests data return immediately
+
+def MicroCurve(arrests_df):
+    lat = arrests_df["latitude"].to_numpy()
+    lon = arrests_df["longitude"].to_numpy()
+
+    # fingerprint the arrest coords
+    fingerprint = hashlib.sha1()
+    fingerprint.update(np.ascontiguousarray(lat).tobytes())
+    fingerprint.update(np.ascontiguousarray(lon).tobytes())
+    fingerprint = fingerprint.hexdigest()
+
+    if fingerprint not in _microcurves:
+        # count arrests at each location
+        keys, first, counts = np.unique(LocationKeys(lat, lon),
+                                        return_index=True,
+                                        return_counts=True)
+
+        # sort locations by arrest count and calculate arrest counts as proportion of total arrests
+        order = np.argsort(-counts, kind="stable")
+        curve = pd.DataFrame({"latitude": lat[first[order]],
+                              "longitude": lon[first[order]],
+                              "Count": counts[order] / len(lat)})
+
+        # get cumulative sum
+        curve["Cumul"] = curve["Count"].cumsum()
+
+        # only keep the most recent curves
+        if len(_microcurves) >= 8:
+            _microcurves.pop(next(iter(_microcurves)))
+        _microcurves[fingerprint] = curve
+
+    return _microcurves[fingerprint]
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame (or Dictionary of DataFrames) + Pandas DataFrame (optional)
 # NAME: HoutSpots_micro
 #DESCRIPTION: Determine the micro-geographic concentration of arrests
+#             If threshold is a list, a dictionary of hotspots for each threshold is returned (and no file is written)
+#             If curve is True then the full concentration curve is also returned
 
-def HotSpots_micro(arrests_df, threshold, output=False):
-    # count total arrests
-    arrestscount = len(arrests_df)
+def HotSpots_micro(arrests_df, threshold, output=False, curve=False):
+    locationtotals = MicroCurve(FilterArrests(arrests_df))
 
-    # count arrests at each street segments
-    locationtotals = arrests_df.groupby(["latitude", "longitude"]).agg({"arrest_key": "count"})
+    hotspots = {}
+    for thr in np.atleast_1d(threshold).tolist():
+        # identify the street segments that contribute to the concentration threshold
+        n_hotspots = np.searchsorted(locationtotals["Cumul"].values, thr, side="right")
+        hotspots[thr] = locationtotals.iloc[:n_hotspots].copy()
 
-    # sort street segments by arrest count and calculate arrest accounts as proportion of total arrests
-    locationtotals.columns=["Count"]
-    locationtotals.sort_values(by="Count", inplace=True, ascending=False)
-    locationtotals["Count"] = locationtotals["Count"]/arrestscount
+        # print the contributing fractions
+        if output == True:
+            contributingfrac = n_hotspots/len(locationtotals)
+            print("{}% of street segments account for {}% of arrests".format(round(100*contributingfrac, 2), 100*thr))
 
-    # get cumulative sum
-    locationtotals["Cumul"] = locationtotals["Count"].cumsum()
-    locationtotals.reset_index(inplace=True)
+    if np.ndim(threshold) == 0:
+        hotspots = hotspots[threshold]
 
-    # identify the street segments that contribute to the concentration threshold
-    hotspots = locationtotals.loc[locationtotals["Cumul"] <= threshold]
+        # save the list of hotspots to a file
+        with resources.path(assets, "hotspots_micro.json") as outfile:
+            hotspots.to_json(outfile)
 
-    # print the contributing fractions
-    if output == True:
-        contributingfrac = len(hotspots)/len(locationtotals)
-        print("{}% of street segments account for {}% of arrests".format(round(100*contributingfrac, 2), 100*threshold))
+    # return the list of hotspots (and the full curve, including the cumulative proportion of street segments)
+    if curve == True:
+        lorenz = locationtotals.copy()
+        lorenz["Segments"] = np.arange(1, len(lorenz) + 1) / len(lorenz)
+        return hotspots, lorenz
 
-    # save the list of hotspots to a file
-    with resources.path(assets, "hotspots_micro.json") as outfile:
-        hotspots.to_json(outfile)
-
-    # return the list of hotspots
     return hotspots
 
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
-# NAME: HoutSpots_micro
-#DESCRIPTION: Determine the micro-geographic concentration of arrests
+# NAME:  FilterArrests
+# DESCRIPTION:  Filter arrests using a dictionary of {column: value} or {column: [list of values]} pairs
+#               arrests_df can also be an ArrestIndex, in which case the filters are looked up in the index
 
-def HotSpots_meso(arrests_df, topN=5):
+def FilterArrests(arrests_df, filters=None):
+    if not isinstance(arrests_df, pd.DataFrame):
+        return arrests_df.frame(filters=filters)
 
-    # identify the 5 census tracts in each borough with highest concentrations of arrests
-    for boro in ["M", "K", "B", "Q", "S"]:
-        mydf = arrests_df.groupby(["arrest_boro", "OBJECTID"]).agg(count=("arrest_key", "count"))
-        mydf.sort_values(["arrest_boro", "count"], ascending=False, inplace=True)
-        badtracts = mydf.loc[boro].head(topN)
+    if not filters:
+        return arrests_df
 
-        if 'hotspots' in locals():
-            hotspots = pd.concat([hotspots, badtracts])
-        else:
-            hotspots = badtracts
+    cond = np.ones(len(arrests_df), dtype=bool)
+    for col, values in filters.items():
+        cond &= arrests_df[col].isin(np.atleast_1d(values)).values
+
+    return arrests_df.loc[cond]
 
-    hotspots.reset_index(inplace=True)
 
-    # read in census tract GIS data
-    with resources.path("DATA9003.assets", "censustracts.geojson") as censusfile:
-        census = gpd.read_file(censusfile)
-        census = census[["OBJECTID", "geometry"]]
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame (or Dictionary of DataFrames)
+# NAME: HotSpots_meso
+# DESCRIPTION: Determine the census tracts in each borough with the highest concentrations of arrests
+#              Arrests can be filtered first (e.g. filters={"year": 2015, "ofns_type": "Drugs"})
+#              If topN is a list, a dictionary of hotspots for each value is returned (and no file is written)
+
+def HotSpots_meso(arrests_df, topN=5, filters=None):
+    boros = ["M", "K", "B", "Q", "S"]
+
+    # count the arrests in each census tract
+    mydf = FilterArrests(arrests_df, filters)
+    counts = mydf.groupby(["arrest_boro", "OBJECTID"], observed=True).size()
+    counts = counts.rename("count").reset_index()
+
+    # rank census tracts within each borough by arrest count
+    counts["arrest_boro"] = pd.Categorical(counts["arrest_boro"], categories=boros, ordered=True)
+    counts = counts.dropna(subset=["arrest_boro"])
+    counts = counts.sort_values(["arrest_boro", "count"],
+                                ascending=[True, False],
+                                kind="mergesort")
+    counts["rank"] = counts.groupby("arrest_boro", observed=True).cumcount()
+
+    # central coords of each census tract
+    tractpoints = loadtractpoints()
+
+    hotspots = {}
+    for n in np.atleast_1d(topN).tolist():
+        # identify the n census tracts in each borough with highest concentrations of arrests
+        badtracts = counts.loc[counts["rank"] < n, ["OBJECTID"]]
+
+        # return ID and central coords of hotspot census tracts
+        hotspots[n] = pd.merge(badtracts,
+                               tractpoints,
+                               how="left",
+                               on="OBJECTID").reset_index(drop=True)
 
-    # match hotspots to GIS data & get centre
-    hotspots=pd.merge(census,
-                      hotspots,
-                      how="right",
-                      on="OBJECTID")
+    if np.ndim(topN) == 0:
+        hotspots = hotspots[topN]
 
-    hotspots["point"] = hotspots.geometry.representative_point()
+        with resources.path("DATA9003.assets", "hotspots_meso.json") as outfile:
+            hotspots.to_json(outfile)
 
-    # get lat and long from GIS object
-    hotspots["longitude"] = hotspots.point.x
-    hotspots["latitude"] = hotspots.point.y
+    return hotspots
 
-    # return ID and central coords of hotspot census tracts
-    hotspots = hotspots[["OBJECTID", "latitude", "longitude"]]
 
-    with resources.path("DATA9003.assets", "hotspots_meso.json") as outfile:
-        hotspots.to_json(outfile)
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME: HotSpots_rolling
+# DESCRIPTION: Determine the topN census tracts in each borough with the highest concentrations of arrests in each quarter
+#              Hotspots for a quarter use the arrests made in a trailing window of quarters (ending with that quarter)
+#              The first quarters use all arrests made up to that quarter
+#              Arrests can be filtered first (e.g. filters={"ofns_type": "Drugs"})
+
+def HotSpots_rolling(arrests_df, window=4, topN=5, filters=None):
+    boros = ["M", "K", "B", "Q", "S"]
+
+    mydf = FilterArrests(arrests_df, filters)
+    mydf = mydf.loc[mydf["arrest_boro"].isin(boros)]
+
+    # number each census tract & quarter
+    tracts = mydf.groupby(["arrest_boro", "OBJECTID"], observed=True).size().index
+    tract_idx = tracts.get_indexer(pd.MultiIndex.from_arrays([mydf["arrest_boro"], mydf["OBJECTID"]]))
+    tract_boro = pd.Categorical(tracts.get_level_values(0), categories=boros).codes
+    tract_id = tracts.get_level_values(1).values
+
+    quarters = np.arange(mydf["quarter"].min(), mydf["quarter"].max() + 1)
+    quarter_idx = mydf["quarter"].values - quarters[0]
+
+    # count the arrests in each census tract in each quarter
+    table = np.zeros((len(quarters), len(tracts)), dtype=np.int64)
+    np.add.at(table, (quarter_idx, tract_idx), 1)
+
+    # slide the window over the quarters, adding the quarter that enters the window & removing the one that leaves
+    running = np.zeros(len(tracts), dtype=np.int64)
+    hotspots = []
+
+    for i, quarter in enumerate(quarters):
+        running += table[i]
+        if i >= window:
+            running -= table[i - window]
+
+        # rank tracts within each borough by arrest count
+        order = np.lexsort((-running, tract_boro))
+        boro_sorted = tract_boro[order]
+        first = np.searchsorted(boro_sorted, boro_sorted, side="left")
+        rank = np.arange(len(order)) - first
+
+        hot = order[(rank < topN) & (running[order] > 0)]
+        hotspots.append(pd.DataFrame({"quarter": quarter,
+                                      "OBJECTID": tract_id[hot]}))
+
+    hotspots = pd.concat(hotspots, ignore_index=True)
+
+    # get central coords of hotspot census tracts
+    hotspots = pd.merge(hotspots,
+                        loadtractpoints(),
+                        how="left",
+                        on="OBJECTID")
 
     return hotspots
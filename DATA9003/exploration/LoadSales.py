@@ -1,67 +1,259 @@
 import os
+import pickle
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-from geopy.extra.rate_limiter import RateLimiter
+import shapely
+import pyarrow.compute as pc
 from geopy.geocoders import ArcGIS
 from importlib import resources
+from concurrent.futures import ProcessPoolExecutor
 
-from DATA9003.misc.schools import loadschools
-from DATA9003.misc.parks import loadparks
-from DATA9003.misc.subway import loadstations
-from DATA9003.misc.uni import loadthirdlvl
+from DATA9003.misc.amenities import amenityindex, nearestamenities
+from DATA9003.misc.geocoding import geocodequeries, addressindex, matchaddresses
+from DATA9003.exploration.Periods import QuarterCode, MonthCode, AddPeriods
+from DATA9003.misc.projection import ProjectCoords
+from DATA9003.misc.regions import regionindex, assignregions
 from DATA9003 import assets
+from DATA9003.exploration.DataCache import SalesSchema, IngestSchema, ApplySchema, CsvDtypes, MemoryReport, CachePath, SourceKey, ReadCache, WriteCache
 from sklearn.neighbors import BallTree
+from scipy.spatial import cKDTree
+
+
+# columns read from the sales workbooks (columns A:B, I & K:U)
+SalesCols = ["borough",
+             "neighbourhood",
+             "address",
+             "zipcode",
+             "resi_units",
+             "comm_units",
+             "total_units",
+             "land_sqft",
+             "gross_sqft",
+             "year_built",
+             "tax_cls",
+             "building_cls",
+             "sale_price",
+             "sale_date"]
+
+# sales included in our analysis
+# purchases of a single residential unit
+# not on extreme ends of price scale
+# one-family homes that are detached (A1) and terraced/semi-d (A5)
+# valid construction years
+# not in manhattan (excluded from our analysis)
+SalesFilter = ((pc.field("resi_units") == 1) & (pc.field("comm_units") == 0) & (pc.field("total_units") == 1) &
+               (pc.field("sale_price") > 150000) & (pc.field("sale_price") < 1 * (10 ** 6)) &
+               pc.match_substring_regex(pc.field("building_cls"), "A1|A5") &
+               (pc.field("year_built") > 0) &
+               (pc.field("borough") != 1))
 
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
 # NAME:  NearestDistance
 # DESCRIPTION:  Get distance for each (lat, long) pair in FROM to their nearest neighbour in TO
+#               TO can also be an (n, 2) array of coords already in radians (e.g. from assetcoords)
+#               Points in FROM without coordinates (e.g. unmatched addresses) get NaN; points in TO without coordinates are ignored
 
 def NearestDistance(FROM, TO):
 
-    F = pd.DataFrame()
-    T = pd.DataFrame()
-
     # get coordinates in radians
-    for col in FROM[["latitude", "longitude"]]:
-        F[col] = np.deg2rad(FROM[col].values)
-    for col in TO[["latitude", "longitude"]]:
-        T[col] = np.deg2rad(TO[col].values)
+    F = np.deg2rad(FROM[["latitude", "longitude"]].values.astype(float))
+
+    if isinstance(TO, np.ndarray):
+        T = TO
+    else:
+        T = np.deg2rad(TO[["latitude", "longitude"]].values.astype(float))
+    T = T[~np.isnan(T).any(axis=1)]
+
+    distance = np.full(len(F), np.nan)
+    valid = ~np.isnan(F).any(axis=1)
+    if not valid.any() or len(T) == 0:
+        return distance
 
     # initialise BallTree object
-    Btree = BallTree(T.values,
+    Btree = BallTree(T,
                      metric='haversine')
 
     # query the Btree object for the nearest neighbour of each property
-    distance, index = Btree.query(F.values, k=1)
+    nearest, index = Btree.query(F[valid], k=1)
 
     # distances returned are for unit sphere
     # convert to kilometres by multiplying by earth's radius: 6371km
-    distance = distance*6371
+    distance[valid] = nearest.flatten()*6371
+
+    return distance
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  PeriodDistance
+# DESCRIPTION:  Get distance for each (lat, long) pair in FROM to their nearest neighbour in TO in the same period
+#               If TO has no points for a period, the points for the latest earlier period (or else the first period) are used
+
+def PeriodDistance(FROM, TO, period="quarter"):
+    distance = np.full(len(FROM), np.nan)
+
+    # periods whose points all lack coordinates fall back like periods with no points
+    TO = TO.dropna(subset=["latitude", "longitude"])
+    if TO.empty:
+        return distance
 
-    return distance.flatten()
+    TO_periods = np.sort(TO[period].unique())
+    TO_groups = TO.groupby(period)
+
+    # find the period of TO to use for each period in FROM
+    for t, rows in FROM.groupby(period).indices.items():
+        pos = max(np.searchsorted(TO_periods, t, side="right") - 1, 0)
+
+        # each nearest neighbour index is built once & queried for all points in the period
+        distance[rows] = NearestDistance(FROM.iloc[rows], TO_groups.get_group(TO_periods[pos]))
+
+    return distance
 
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
+# NAME:  CrimeExposure
+# DESCRIPTION:  Count the arrests made near each property in the months before it was sold
+#               For each offence type (column by, plus all arrests), radius (m) and window (months), get the number of arrests
+#               within radius of the property in the window before the sale date & the inverse-distance-weighted sum (1/km)
+#               Arrests within mindist (m) of a property are treated as being mindist away when weighting
+
+def CrimeExposure(sales_df, arrests_df, radii=(250, 500, 1000), windows=(3, 12, 36), by="ofns_type", mindist=10, batchsize=2000):
+    radii = np.sort(radii)
+    windows = np.sort(windows)
+    n_r = len(radii)
+    n_w = len(windows)
+
+    # offence type of each arrest
+    # only types present in the arrests are used & are sorted, so the columns don't depend on how the arrests were loaded
+    if by is None:
+        types = []
+        a_type = np.zeros(len(arrests_df), dtype=int)
+    else:
+        a_cat = pd.Categorical(arrests_df[by]).remove_unused_categories()
+        a_cat = a_cat.reorder_categories(sorted(a_cat.categories))
+        types = list(a_cat.categories)
+        a_type = a_cat.codes
+    n_t = max(len(types), 1)
+
+    # arrest dates & coords in metres, sorted by date
+    a_date = arrests_df["arrest_date"].values.astype("datetime64[D]")
+    order = np.argsort(a_date, kind="stable")
+    a_date = a_date[order]
+    a_type = a_type[order]
+    a_x, a_y = ProjectCoords(arrests_df["latitude"].values[order], arrests_df["longitude"].values[order])
+    a_xy = np.column_stack([a_x, a_y]) * 0.3048
+
+    # sales with known coords, their coords in metres & the start date of each window before the sale date
+    valid = (sales_df["latitude"].notna() & sales_df["longitude"].notna()).values
+    sales = sales_df.loc[valid]
+    s_date = pd.to_datetime(sales["sale_date"])
+    s_x, s_y = ProjectCoords(sales["latitude"].values, sales["longitude"].values)
+    s_xy = np.column_stack([s_x, s_y]) * 0.3048
+    s_start = np.column_stack([(s_date - pd.DateOffset(months=int(w))).values.astype("datetime64[D]") for w in windows])
+    s_date = s_date.values.astype("datetime64[D]")
+
+    counts = np.zeros((len(sales), n_t, n_r, n_w), dtype=np.int32)
+    idw = np.zeros((len(sales), n_t, n_r, n_w), dtype=np.float32)
+
+    # handle the sales for each month together, arrests in the longest window before any of them are found by binary search
+    s_month = s_date.astype("datetime64[M]")
+    for month in np.unique(s_month):
+        rows = np.nonzero(s_month == month)[0]
+
+        lwr = np.searchsorted(a_date, s_start[rows, -1].min(), side="left")
+        upr = np.searchsorted(a_date, s_date[rows].max(), side="left")
+        if upr <= lwr:
+            continue
+
+        # spatial index of the arrests in the window
+        arrest_tree = cKDTree(a_xy[lwr:upr])
+
+        for b in range(0, len(rows), batchsize):
+            batch = rows[b:b + batchsize]
+
+            # all (sale, arrest) pairs within the largest radius
+            sales_tree = cKDTree(s_xy[batch])
+            pairs = sales_tree.sparse_distance_matrix(arrest_tree, radii[-1], output_type="ndarray")
+
+            i = pairs["i"]
+            j = pairs["j"] + lwr
+            dist = pairs["v"]
+
+            # smallest radius & window containing each arrest (arrests on/after the sale date or before the longest window are dropped)
+            p_date = a_date[j]
+            r_band = np.searchsorted(radii, dist, side="left")
+            w_band = (p_date[:, None] < s_start[batch[i]]).sum(axis=1)
+            keep = (p_date < s_date[batch[i]]) & (w_band < n_w)
+
+            # count arrests in each (sale, type, radius, window) cell
+            cell = ((i * n_t + a_type[j]) * n_r + r_band) * n_w + w_band
+            n_cells = len(batch) * n_t * n_r * n_w
+            weights = 1000 / np.maximum(dist, mindist)
+
+            batch_counts = np.bincount(cell[keep], minlength=n_cells)
+            batch_idw = np.bincount(cell[keep], weights=weights[keep], minlength=n_cells)
+
+            # radii & windows are nested, so sum over the smaller ones
+            shape = (len(batch), n_t, n_r, n_w)
+            counts[batch] = batch_counts.reshape(shape).cumsum(axis=2).cumsum(axis=3)
+            idw[batch] = batch_idw.reshape(shape).cumsum(axis=2).cumsum(axis=3)
+
+    # arrange results as columns named [n/idw]_[type]_[radius]m_[window]mo
+    labels = ["all"] + ["".join(c if c.isalnum() else "_" for c in str(t).lower()) for t in types]
+    features = {}
+    for t, label in enumerate(labels):
+        for r, radius in enumerate(radii):
+            for w, window in enumerate(windows):
+                if label == "all":
+                    n_col = counts[:, :, r, w].sum(axis=1)
+                    idw_col = idw[:, :, r, w].sum(axis=1)
+                else:
+                    n_col = counts[:, t - 1, r, w]
+                    idw_col = idw[:, t - 1, r, w]
+
+                features["n_{}_{}m_{}mo".format(label, radius, window)] = n_col
+                features["idw_{}_{}m_{}mo".format(label, radius, window)] = idw_col
+
+    exposure = pd.DataFrame(features, index=sales.index)
+
+    return exposure.reindex(sales_df.index)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series
 # NAME:  DistanceToShore
-# DESCRIPTION:  Calculate the distance to shore for each property in houses
+# DESCRIPTION:  Calculate the distance to shore (in ft) for each property in houses
+#               shoreline is the spatial index returned by ShorelineIndex (loaded from asset if not given)
 
-def DistanceToShore(houses):
+def DistanceToShore(houses, shoreline=None):
+    if shoreline is None:
+        shoreline = ShorelineIndex()
 
-    # create GeoDataFrame to use coords as GIS data
-    geodf = gpd.GeoDataFrame(houses,
-                             geometry=gpd.points_from_xy(houses.longitude,
-                                                         houses.latitude))
-    geodf.set_crs(epsg=4326,
-                  inplace=True)
-    # transform to coord ref system EPSG:2263, this means resulting distances will be in ft
-    geodf.to_crs(epsg=2263,
-                 inplace=True)
+    # transform coords to coord ref system EPSG:2263, this means resulting distances will be in ft
+    valid = (houses["latitude"].notna() & houses["longitude"].notna()).values
+    x, y = ProjectCoords(houses["latitude"].values[valid], houses["longitude"].values[valid])
+
+    # query the index for the distance from each property to the nearest shoreline segment
+    (pointidx, _), distance = shoreline.query_nearest(shapely.points(x, y),
+                                                      return_distance=True,
+                                                      all_matches=False)
+
+    dist2shore = np.full(len(houses), np.nan)
+    dist2shore[np.nonzero(valid)[0][pointidx]] = distance
 
-    # read in GIS data for NYC shoreline
+    return pd.Series(dist2shore, index=houses.index)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: GeoPandas GeoDataFrame
+# NAME:  LoadShoreline
+# DESCRIPTION:  Load the GIS data for the NYC shoreline from asset (in coord ref system EPSG:2263)
+
+def LoadShoreline():
     with resources.path(assets, "shoreline.geojson") as filepath:
         geofile = open(filepath, "r")
         shoreline = gpd.read_file(geofile)
@@ -69,54 +261,112 @@ def DistanceToShore(houses):
         shoreline.to_crs(epsg=2263, inplace=True)
         geofile.close()
 
-    # geopandas has some functionality for calculating distances between different geometries
-    def getdist(point):
-        distances = shoreline.distance(point)
-        return min(distances)
+    return shoreline
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Shapely STRtree
+# NAME:  ShorelineIndex
+# DESCRIPTION:  Load the spatial index of NYC shoreline segments (in coord ref system EPSG:2263) from asset
+#               If the asset is missing or older than the shoreline GIS data then it is regenerated
+
+def ShorelineIndex():
+    with resources.path(assets, "shoreline.geojson") as shorefile:
+        shoretime = os.path.getmtime(shorefile)
+
+    with resources.path(assets, "shoreline_index.pkl") as filepath:
+        if os.path.exists(filepath) and (os.path.getmtime(filepath) >= shoretime):
+            with open(filepath, "rb") as indexfile:
+                shoreline = pickle.load(indexfile)
+        else:
+            parts = LoadShoreline().geometry.explode(index_parts=False).values
+            lines = shapely.get_type_id(parts) == 1
+
+            # break lines into single segments so the index can discard distant parts of long lines
+            # (other geometries, e.g. polygons, are kept whole)
+            coords, lineidx = shapely.get_coordinates(parts[lines], return_index=True)
+            inline = lineidx[1:] == lineidx[:-1]
+            segments = shapely.linestrings(np.stack([coords[:-1][inline], coords[1:][inline]], axis=1))
+
+            shoreline = shapely.STRtree(np.concatenate([segments, parts[~lines]]))
 
-    # get the distance to shore for each property
-    dist2shore = geodf.geometry.apply(getdist)
+            with open(filepath, "wb") as indexfile:
+                pickle.dump(shoreline, indexfile)
 
-    return dist2shore
+    return shoreline
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  SalesAssets
+# DESCRIPTION:  Load the assets needed to build the property sales dataset (property coords, amenities, shoreline & hotspots)
+#               hotspots are as described for LoadOneYear (hotspots_meso.json if not given)
+
+def SalesAssets(hotspots=None):
+    if hotspots is None:
+        with resources.path(assets, "hotspots_meso.json") as filepath:
+            hotspots = pd.read_json(filepath)
+
+    return {"addresses": addressindex(),
+            "schools": amenityindex("schools"),
+            "parks": amenityindex("parks"),
+            "sbwy": amenityindex("sbwy"),
+            "uni": amenityindex("uni"),
+            "shoreline": ShorelineIndex(),
+            "hotspots": hotspots,
+            "regions": regionindex()}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  ReadWorkbook
+# DESCRIPTION:  Read the rows of a sales workbook that pass the given filters (a pyarrow expression)
+#               Each workbook is converted once to a parquet file in IngestDir, which is read instead until the workbook changes
+
+def ReadWorkbook(filepath, IngestDir, filters=None):
+    cachepath = os.path.join(IngestDir, os.path.splitext(os.path.basename(filepath))[0] + ".parquet")
+
+    # the cache is only valid for this exact version of the workbook
+    key = SourceKey(filepath)
+
+    sales_df = ReadCache(cachepath, IngestSchema, key=key, filters=filters)
+
+    if sales_df is None:
+        sales_df = pd.read_excel(filepath,
+                                 usecols="A:B,I,K:U",
+                                 skiprows=1,
+                                 header=None,
+                                 names=SalesCols)
+        sales_df = ApplySchema(sales_df, IngestSchema)
+
+        os.makedirs(IngestDir, exist_ok=True)
+        WriteCache(sales_df, cachepath, IngestSchema, key)
+
+        sales_df = ReadCache(cachepath, IngestSchema, key=key, filters=filters)
+
+    return sales_df
 
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
 # NAME:  LoadOneYear
 # DESCRIPTION:  Load the property sales data for a given year
+#               hotspots can be any DataFrame of (lat, long) coords, e.g. the output of HotSpots_grid
+#               or hotspots for each quarter, e.g. the output of HotSpots_rolling
+#               If the arrests data is given then crime exposure features (see CrimeExposure) are added
+#               Assets are loaded by SalesAssets unless already loaded assets are given (in which case hotspots is ignored)
 
-def LoadOneYear(SalesDir, yr):
+def LoadOneYear(SalesDir, yr, hotspots=None, arrests=None, myassets=None):
     mydir = os.path.join(SalesDir, str(yr))
     myfiles = os.listdir(mydir)
+    ingestdir = os.path.join(SalesDir, "ingest", str(yr))
 
-    cols = ["borough",
-            "neighbourhood",
-            "address",
-            "zipcode",
-            "resi_units",
-            "comm_units",
-            "total_units",
-            "land_sqft",
-            "gross_sqft",
-            "year_built",
-            "tax_cls",
-            "building_cls",
-            "sale_price",
-            "sale_date"]
+    if myassets is None:
+        myassets = SalesAssets(hotspots)
 
     # read and concatenate sales data for each borough
-    for file in myfiles:
-        df_temp = pd.read_excel(os.path.join(mydir, file),
-                                usecols="A:B,I,K:U",
-                                skiprows=1,
-                                header=None,
-                                names=cols)
-
-        if "sales_df" not in locals():
-            sales_df = df_temp
-        else:
-            sales_df = pd.concat([sales_df, df_temp])
-    del df_temp
+    # only sales included in our analysis are loaded (see SalesFilter)
+    sales_df = pd.concat([ReadWorkbook(os.path.join(mydir, file), ingestdir, SalesFilter) for file in myfiles])
 
     # change borough values from numerical encoding to names
     boroughs = {1: "M",
@@ -128,30 +378,6 @@ def LoadOneYear(SalesDir, yr):
     sales_df["borough"].replace(boroughs,
                                 inplace=True)
 
-    # filter for purchases of a single residential unit
-    cond0a = sales_df["resi_units"] == 1
-    cond0b = sales_df["comm_units"] == 0
-    cond0c = sales_df["total_units"] == 1
-
-    # filter out properties on extreme ends of price scale
-    cond1a = 150000 < sales_df["sale_price"]
-    cond1b = sales_df["sale_price"] < 1 * (10 ** 6)
-
-    # filter for one-family homes that are detached (A1) and terraced/semi-d (A5)
-    cond2 = sales_df.building_cls.str.contains("A1|A5")
-
-    # remove sales of properties with invalid construction years
-    cond3 = sales_df.year_built > 0
-
-    # manhattan is excluded from our analysis
-    cond4 = sales_df.borough != "M"
-
-    sales_df = sales_df.loc[(cond0a & cond0b & cond0c) &
-                            (cond1a & cond1b) &
-                            (cond2) &
-                            (cond3) &
-                            (cond4)]
-
     # some addresses include apartment numbers (in the format [ST ADDRESS, APT NO.])
     # the apartment no. can be removed
     sales_df["address"] = sales_df.address.str.split(",").str[0]
@@ -161,24 +387,24 @@ def LoadOneYear(SalesDir, yr):
     sales_df.drop_duplicates(inplace=True,
                              ignore_index=True)
 
-    with resources.path("DATA9003.assets", "PropertyCoords.csv") as coordfile:
-        coords = pd.read_csv(coordfile,
-                             usecols=["StreetAddress",
-                                      "latitude",
-                                      "longitude"])
-
-    sales_df = pd.merge(sales_df, coords,
-                        how="left",
-                        left_on=["address"],
-                        right_on=["StreetAddress"])
+    # match addresses (& zipcodes) to property coords
+    coords = matchaddresses(sales_df["address"],
+                            sales_df["zipcode"],
+                            myassets["addresses"])
+    sales_df["latitude"] = coords["latitude"].values
+    sales_df["longitude"] = coords["longitude"].values
 
     sales_df.drop(["resi_units",
                    "comm_units",
-                   "total_units",
-                   "StreetAddress"],
+                   "total_units"],
                   axis=1,
                   inplace=True)
 
+    # match property coords to census tract
+    sales_df["OBJECTID"] = assignregions(sales_df["latitude"],
+                                         sales_df["longitude"],
+                                         myassets["regions"])["OBJECTID"].values
+
     # extract year from date
     sales_df["year"] = sales_df["sale_date"].dt.year
     sales_df = sales_df.loc[sales_df.year < 2021]
@@ -188,73 +414,136 @@ def LoadOneYear(SalesDir, yr):
                   axis=1,
                   inplace=True)
 
-    # extract quarter from date
-    sales_df["quarter"] = sales_df["sale_date"].dt.quarter + 4*(sales_df["year"] - min(sales_df["year"]))
-
-    # extract month from date
-    sales_df["month"] = sales_df["sale_date"].dt.month + 12*(sales_df["year"] - min(sales_df["year"]))
+    # extract quarter & month from date (numbered on the same time axis as the arrests data)
+    sales_df["quarter"] = QuarterCode(sales_df["sale_date"])
+    sales_df["month"] = MonthCode(sales_df["sale_date"])
 
     # Distance to nearest school
-    schools = loadschools()
-    sales_df["dist2school"] = NearestDistance(sales_df, schools.loc[schools.year_opened <= yr])
+    # (only schools already open in the year of the sale)
+    distance, _ = nearestamenities(myassets["schools"], sales_df["latitude"], sales_df["longitude"], asof=sales_df["year"])
+    sales_df["dist2school"] = distance[:, 0]
 
     # Distance to nearest park
-    parks = loadparks()
-    sales_df["dist2park"] = NearestDistance(sales_df, parks)
+    distance, _ = nearestamenities(myassets["parks"], sales_df["latitude"], sales_df["longitude"])
+    sales_df["dist2park"] = distance[:, 0]
 
     # Distance to transport hub
-    sbwy = loadstations()
-    sales_df["dist2sbwy"] = NearestDistance(sales_df, sbwy)
+    distance, _ = nearestamenities(myassets["sbwy"], sales_df["latitude"], sales_df["longitude"])
+    sales_df["dist2sbwy"] = distance[:, 0]
 
     # Distance to college/university
-    uni = loadthirdlvl()
-    sales_df["dist2uni"] = NearestDistance(sales_df, uni)
+    distance, _ = nearestamenities(myassets["uni"], sales_df["latitude"], sales_df["longitude"])
+    sales_df["dist2uni"] = distance[:, 0]
 
     # Distance to shore
-    sales_df["dist2shore"] = DistanceToShore(sales_df[["latitude", "longitude"]])
+    sales_df["dist2shore"] = DistanceToShore(sales_df[["latitude", "longitude"]], myassets["shoreline"])
+
+    # Distance to crime hotspot (hotspots_meso.json unless another set of hotspots is given)
+    # if hotspots are given for each quarter then use the hotspots for the quarter of each sale
+    hotspots = myassets["hotspots"]
+    if "quarter" in hotspots.columns:
+        sales_df["dist2crime"] = PeriodDistance(sales_df, hotspots, "quarter")
+    else:
+        sales_df["dist2crime"] = NearestDistance(sales_df, hotspots)
 
-    # Distance to crime hotspot
-    with resources.path(assets, "hotspots_meso.json") as filepath:
-        hotspots = pd.read_json(filepath)
-    sales_df["dist2crime"] = NearestDistance(sales_df, hotspots)
+    # Arrests near property before sale
+    if arrests is not None:
+        sales_df = sales_df.join(CrimeExposure(sales_df, arrests))
 
     return sales_df
 
 
+# assets (and arrests data) used by worker processes, set once per process by InitWorker
+_workerassets = None
+_workerarrests = None
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  InitWorker
+# DESCRIPTION:  Store the assets (loaded once by the parent process) and arrests data for use by a worker process
+
+def InitWorker(myassets, arrests=None):
+    global _workerassets, _workerarrests
+    _workerassets = myassets
+    _workerarrests = arrests
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  LoadShard
+# DESCRIPTION:  Load the property sales data for a given year using the assets stored by InitWorker
+
+def LoadShard(SalesDir, yr):
+    return LoadOneYear(SalesDir, yr, arrests=_workerarrests, myassets=_workerassets)
+
+
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
 # NAME:  LoadSalesData
 # DESCRIPTION:  Load the property sales data for all years
+#               hotspots and arrests (see LoadOneYear) are only used if the data has to be reloaded from the source files
+#               If workers is given then years are loaded in parallel by a pool of that many processes
+#               The parquet cache is only used while NYC_propertysales.csv is unchanged (deleting the csv forces a reload)
 
-def LoadSalesData(SalesDir):
+def LoadSalesData(SalesDir, columns=None, hotspots=None, arrests=None, workers=None):
     filepath = os.path.join(SalesDir, "NYC_propertysales.csv")
+    cachepath = CachePath(filepath)
 
-    if os.path.exists(filepath):
-        allsales = pd.read_csv(filepath,
-                               parse_dates=[7])
+    # the cache mirrors this version of the csv file
+    key = SourceKey(filepath)
+    if key is None:
+        allsales = None
     else:
-        # collate sales data for all years
-        for yr in range(2006, 2021):
-            sales_yr = LoadOneYear(SalesDir, yr)
+        allsales = ReadCache(cachepath, SalesSchema, columns, key=key)
 
-            if "allsales" not in locals():
-                allsales = sales_yr
+    if allsales is None:
+
+        if os.path.exists(filepath):
+            allsales = pd.read_csv(filepath,
+                                   parse_dates=[7],
+                                   dtype=CsvDtypes(SalesSchema,
+                                                   exclude=["quarter", "month"],
+                                                   columns=pd.read_csv(filepath, nrows=0).columns))
+
+            # files written by older versions number quarters/months within each year
+            allsales = AddPeriods(allsales, "sale_date")
+        else:
+            # load the assets once, they are shared by every year
+            years = list(range(2006, 2021))
+            myassets = SalesAssets(hotspots)
+
+            # collate sales data for all years
+            if workers is None:
+                allsales = [LoadOneYear(SalesDir, yr, arrests=arrests, myassets=myassets) for yr in years]
             else:
-                allsales = pd.concat([allsales, sales_yr])
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=InitWorker,
+                                         initargs=(myassets, arrests)) as pool:
+                    allsales = list(pool.map(LoadShard, [SalesDir] * len(years), years))
 
-        allsales.sort_values("sale_date",
-                             inplace=True,
-                             ignore_index=True)
+            allsales = pd.concat(allsales)
 
-        allsales.drop(["neighbourhood",
-                       "address"],
-                      axis=1,
-                      inplace=True)
+            allsales.sort_values("sale_date",
+                                 inplace=True,
+                                 ignore_index=True)
 
-        allsales.to_csv(filepath,
-                        index=False)
+            allsales.drop(["neighbourhood",
+                           "address"],
+                          axis=1,
+                          inplace=True)
 
-    print(allsales.info())
+            allsales.to_csv(filepath,
+                            index=False)
+
+        # write typed cache to avoid having to re-parse the csv file
+        allsales = ApplySchema(allsales, SalesSchema)
+        WriteCache(allsales, cachepath, SalesSchema, SourceKey(filepath))
+
+        if columns is not None:
+            allsales = allsales[columns]
+
+    print(MemoryReport(allsales))
     return allsales
 
 
@@ -262,8 +551,10 @@ def LoadSalesData(SalesDir):
 # RETURN TYPE: Pandas DataFrame
 # NAME:  GeoCodeAddresses
 # DESCRIPTION:  Get coordinates for all unique street addresses in sales_df
+#               Addresses already in the geocoding cache (see geocodequeries) are not geocoded again
+#               geocoder can be any geopy geocoder (ArcGIS by default) or a LocalGeocoder for offline use
 
-def GeocodeAddresses(sales_df, SalesDir=None):
+def GeocodeAddresses(sales_df, SalesDir=None, geocoder=None, cachepath=None):
 
     # only street addresses and zipcodes required for geocoding
     mydf = sales_df.loc[:, ["address", "zipcode"]]
@@ -277,20 +568,18 @@ def GeocodeAddresses(sales_df, SalesDir=None):
                 inplace=True)
 
     # connect to ArcGIS
-    locator = ArcGIS(user_agent="NYCsales")
-
-    # 1 - include delay between geocoding calls (avoid usage limits)
-    geocode = RateLimiter(locator.geocode, min_delay_seconds=0.1)
+    if geocoder is None:
+        geocoder = ArcGIS(user_agent="NYCsales")
 
-    # 2- - create location column
-    mydf['location'] = mydf['FullAddress'].apply(geocode)
+    # geocode (at most 10 calls per second to avoid usage limits)
+    coords = geocodequeries(mydf["FullAddress"],
+                            cachepath,
+                            geocoder,
+                            rate=10)
+    mydf[["latitude", "longitude"]] = coords.values
 
-    # 3 - get long, lat and alt from location column (break tuple into multiple columns)
-    mydf['point'] = mydf['location'].apply(lambda loc: tuple(loc.point) if loc else None)
-    mydf[['latitude', 'longitude', 'altitude']] = pd.DataFrame(mydf['point'].tolist(),
-                                                               index=mydf.index)
     # remove unneeded columns
-    mydf.drop(["FullAddress", "altitude"],
+    mydf.drop(["FullAddress"],
               axis=1,
               inplace=True)
 
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+
+# arrests and sales share a single time axis, numbered from Q1/January of this year (= period 1)
+BaseYear = 2006
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series
+# NAME:  QuarterCode
+# DESCRIPTION:  Convert dates to the number of the quarter they fall in (Q1-2006 = 1, Q2-2006 = 2, ...)
+
+def QuarterCode(dates):
+    dates = pd.to_datetime(dates)
+    codes = 4*(dates.dt.year - BaseYear) + dates.dt.quarter
+
+    return codes.astype("int16")
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series
+# NAME:  MonthCode
+# DESCRIPTION:  Convert dates to the number of the month they fall in (1/2006 = 1, 2/2006 = 2, ...)
+
+def MonthCode(dates):
+    dates = pd.to_datetime(dates)
+    codes = 12*(dates.dt.year - BaseYear) + dates.dt.month
+
+    return codes.astype("int16")
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: List
+# NAME:  PeriodLabel
+# DESCRIPTION:  Convert quarter/month numbers to labels for display ("Q3-2014" or "7/2014")
+
+def PeriodLabel(codes, timestep="month"):
+    codes = np.asarray(codes, dtype=int) - 1
+
+    if timestep == "quarter":
+        return ["Q{}-{}".format(code % 4 + 1, BaseYear + code // 4) for code in codes]
+    else:
+        return ["{}/{}".format(code % 12 + 1, BaseYear + code // 12) for code in codes]
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  AddPeriods
+# DESCRIPTION:  Add (or replace) the quarter and month columns of a DataFrame using the dates in datecol
+
+def AddPeriods(mydf, datecol):
+    mydf[datecol] = pd.to_datetime(mydf[datecol])
+    mydf["quarter"] = QuarterCode(mydf[datecol])
+    mydf["month"] = MonthCode(mydf[datecol])
+
+    return mydf
@@ -8,6 +8,8 @@ from importlib import resources
 import branca.colormap as cm
 
 from DATA9003 import assets
+from DATA9003.exploration.Periods import PeriodLabel
+from DATA9003.exploration.LoadArrests import FilterArrests
 
 
 # OBJECT TYPE: Function
@@ -17,7 +19,7 @@ from DATA9003 import assets
 
 def AnnualArrests(arrests_df, FigDir=None):
 
-    mydf = arrests_df[["year", "arrest_boro"]]
+    mydf = FilterArrests(arrests_df)[["year", "arrest_boro"]]
     mydf.columns = ["Year", "Borough"]
 
     # make pivot table
@@ -52,10 +54,10 @@ def OfnsTypeByBorough(arrests_df, FigDir=None, yr=None):
 
     # filter df if necessary
     if yr is None:
-        mydf = arrests_df[["arrest_boro", "ofns_type"]]
+        mydf = FilterArrests(arrests_df)[["arrest_boro", "ofns_type"]]
         title = "Arrests for Different Offences by Borough"
     else:
-        mydf = arrests_df.loc[arrests_df["year"] == yr][["arrest_boro", "ofns_type"]]
+        mydf = FilterArrests(arrests_df, {"year": yr})[["arrest_boro", "ofns_type"]]
         title = "Arrests for Different Offences in {} by Borough".format(yr)
 
     mydf.columns = ["Borough", "Offence Type"]
@@ -93,10 +95,10 @@ def OfnsDescByBorough(arrests_df, ofns_type, FigDir=None, yr=None):
 
     # filter df if necessary
     if yr is None:
-        mydf = arrests_df.loc[arrests_df["ofns_type"] == ofns_type][["arrest_boro", "ofns_desc"]]
+        mydf = FilterArrests(arrests_df, {"ofns_type": ofns_type})[["arrest_boro", "ofns_desc"]]
         title = "Arrests for {}".format(ofns_type)
     else:
-        mydf = arrests_df.loc[(arrests_df["year"] == yr) & (arrests_df["ofns_type"] == ofns_type)][["arrest_boro", "ofns_desc"]]
+        mydf = FilterArrests(arrests_df, {"year": yr, "ofns_type": ofns_type})[["arrest_boro", "ofns_desc"]]
         title = "Arrests for {} in {}".format(ofns_type, yr)
 
     mydf.columns = ["Borough", "Offence Description"]
@@ -133,13 +135,13 @@ def OfnsDescByBorough(arrests_df, ofns_type, FigDir=None, yr=None):
 def HeatMap_Static(arrests_df, ofns_type=None, ofns_desc=None):
     # apply filters if necessary
     if ofns_type is None:
-        mydf = arrests_df
+        mydf = FilterArrests(arrests_df)
         minopac = 0.01
     elif ofns_desc is None:
-        mydf = arrests_df.loc[(arrests_df["ofns_type"] == ofns_type)]
+        mydf = FilterArrests(arrests_df, {"ofns_type": ofns_type})
         minopac = 0.1
     else:
-        mydf = arrests_df.loc[(arrests_df["ofns_type"] == ofns_type) & (arrests_df["ofns_desc"] == ofns_desc)]
+        mydf = FilterArrests(arrests_df, {"ofns_type": ofns_type, "ofns_desc": ofns_desc})
         minopac = 0.1
 
     # count the number of arrests at each location
@@ -188,11 +190,11 @@ def HeatMap_Static(arrests_df, ofns_type=None, ofns_desc=None):
 def HeatMap_Dynamic(arrests_df, ofns_type=None, ofns_desc=None, timestep="month", FigDir=None):
     # apply filters if necessary
     if ofns_type is None:
-        mydf = arrests_df
+        mydf = FilterArrests(arrests_df)
     elif ofns_desc is None:
-        mydf = arrests_df.loc[(arrests_df["ofns_type"] == ofns_type)]
+        mydf = FilterArrests(arrests_df, {"ofns_type": ofns_type})
     else:
-        mydf = arrests_df.loc[(arrests_df["ofns_type"] == ofns_type) & (arrests_df["ofns_desc"] == ofns_desc)]
+        mydf = FilterArrests(arrests_df, {"ofns_type": ofns_type, "ofns_desc": ofns_desc})
 
     # count the number of arrests at each location at each point in time
     mydf = mydf.groupby(["year", timestep, "latitude", "longitude"]).agg({"arrest_key": "count"})
@@ -225,7 +227,7 @@ def HeatMap_Dynamic(arrests_df, ofns_type=None, ofns_desc=None, timestep="month"
     mymap.add_child(lines)
 
     # heatmap overlay
-    timedata = [t for t in geodf[timestep].unique()]
+    timedata = sorted(geodf[timestep].unique())
     heatdata = []
     for t in timedata:
         # foliums HeatMapWithTime requires data in a specific format
@@ -234,8 +236,9 @@ def HeatMap_Dynamic(arrests_df, ofns_type=None, ofns_desc=None, timestep="month"
         heatdata.append(
             [[point.xy[1][0], point.xy[0][0], wgt] for point, wgt in zip(heat_df.geometry, heat_df.arrest_key)])
 
+    # periods are stored as numbers, convert to labels for display
     plugins.HeatMapWithTime(data=heatdata,
-                            index=timedata,
+                            index=PeriodLabel(timedata, timestep),
                             min_opacity=0.2).add_to(mymap)
 
     if FigDir is not None:
@@ -254,9 +257,9 @@ def CrimeChoropleth(arrests_df, yr=None, FigDir=None):
 
     # filter data for relevant year if specified
     if yr is not None:
-        mydf = arrests_df.loc[arrests_df.year == yr]
+        mydf = FilterArrests(arrests_df, {"year": yr})
     else:
-        mydf = arrests_df
+        mydf = FilterArrests(arrests_df)
 
     # count the number of arrests in each tract
     mydf = mydf.groupby(["OBJECTID"]).agg(count=("arrest_key", "count"))
@@ -0,0 +1,165 @@
+from DATA9003 import assets
+
+# DATA HANDLING
+import os
+import pickle
+import numpy as np
+from importlib import resources
+from sklearn.neighbors import BallTree
+
+from DATA9003.misc.schools import readschools
+from DATA9003.misc.parks import readparks
+from DATA9003.misc.subway import readstations
+from DATA9003.misc.uni import readthirdlvl
+from DATA9003.misc.assetcache import cachedasset, assetcoords
+
+
+# amenities that can be indexed: asset file holding the locations, function to read them & year each amenity opened (if known)
+amenities = {"schools": ("schools.json", readschools, "year_opened"),
+             "parks": ("parks.geojson", readparks, None),
+             "sbwy": ("transport_hubs.geojson", readstations, None),
+             "uni": ("thirdlevel.csv", readthirdlvl, None)}
+
+# nearest neighbour index of each amenity, built once per process by amenityindex
+_amenityindex = {}
+
+# version of the saved indices, must be increased whenever their contents change so old indices are rebuilt
+IndexVersion = 2
+
+# earth's radius (km), distances on the unit sphere are multiplied by this
+EarthRadius = 6371
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  amenityindex
+# DESCRIPTION:  Get the nearest neighbour index (haversine BallTree) of the locations of an amenity
+#               If the year each amenity opened is known, the index can also find the nearest amenity open in a given year
+#               The index is saved as an asset & reloaded from it until the amenity asset changes
+
+def amenityindex(name):
+    sourcefile, reader, timecol = amenities[name]
+
+    with resources.path(assets, sourcefile) as filepath:
+        sourcetime = os.path.getmtime(filepath) if os.path.exists(filepath) else np.inf
+
+    # index already built by this process (and amenity asset unchanged since)
+    if (name in _amenityindex) and (_amenityindex[name]["sourcetime"] == sourcetime):
+        return _amenityindex[name]
+
+    with resources.path(assets, "{}_index.pkl".format(name)) as filepath:
+        index = None
+        if os.path.exists(filepath) and (os.path.getmtime(filepath) >= sourcetime):
+            with open(filepath, "rb") as indexfile:
+                index = pickle.load(indexfile)
+
+            if index.get("version") != IndexVersion:
+                index = None
+
+        if index is None:
+            # loading the amenity may regenerate its asset
+            locations = cachedasset(sourcefile, reader)["data"]
+            with resources.path(assets, sourcefile) as sourcepath:
+                sourcetime = os.path.getmtime(sourcepath)
+
+            # get coordinates in radians
+            coords = assetcoords(sourcefile, reader, "radians")
+
+            index = {"version": IndexVersion,
+                     "tree": BallTree(coords, metric="haversine"),
+                     "names": locations["name"].values if "name" in locations.columns else None}
+
+            if timecol is not None:
+                index.update(timeblocks(coords, locations[timecol].values))
+
+            with open(filepath, "wb") as indexfile:
+                pickle.dump(index, indexfile)
+
+    index["sourcetime"] = sourcetime
+    _amenityindex[name] = index
+
+    return index
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  timeblocks
+# DESCRIPTION:  Split amenities into blocks of opening years so the amenities open in any year are the union of a few blocks
+#               Block b (1, 2, ...) holds the amenities that opened in the b - lowbit(b) + 1, ..., b-th distinct year (as in a Fenwick tree)
+#               The amenities open in the first g distinct years are covered by blocks g, g - lowbit(g), ... (at most log2(g) + 1 blocks)
+
+def timeblocks(coords, opened):
+    years = np.unique(opened)
+    group = np.searchsorted(years, opened)
+
+    blocks = [None]
+    for b in range(1, len(years) + 1):
+        members = np.nonzero((group >= b - (b & -b)) & (group < b))[0]
+        blocks.append({"tree": BallTree(coords[members], metric="haversine"),
+                       "positions": members})
+
+    return {"years": years,
+            "blocks": blocks}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array (x2)
+# NAME:  nearestamenities
+# DESCRIPTION:  Get the distances (km) to and positions of the k nearest amenities to each (lat, long) pair
+#               If asof (a year for each pair) is given, only amenities open in that year are used (the index must have opening years)
+#               Points with missing coords (or with fewer than k amenities open) are given NaN distances and position -1
+
+def nearestamenities(index, latitude, longitude, k=1, asof=None):
+    coords = np.deg2rad(np.column_stack([latitude, longitude]).astype(float))
+    valid = ~np.isnan(coords).any(axis=1)
+
+    distance = np.full((len(coords), k), np.inf)
+    position = np.full((len(coords), k), -1)
+
+    if asof is None:
+        if valid.any():
+            distance[valid], position[valid] = index["tree"].query(coords[valid], k=k)
+    else:
+        # number of distinct opening years up to each year
+        nodes = np.searchsorted(index["years"], np.asarray(asof), side="right")
+        nodes[~valid] = 0
+
+        # query each block once for all points it covers, keeping the k nearest amenities found so far
+        while (nodes > 0).any():
+            for b in np.unique(nodes[nodes > 0]):
+                rows = np.nonzero(nodes == b)[0]
+                block = index["blocks"][b]
+                kk = min(k, len(block["positions"]))
+
+                blockdist, blockpos = block["tree"].query(coords[rows], k=kk)
+
+                alldist = np.concatenate([distance[rows], blockdist], axis=1)
+                allpos = np.concatenate([position[rows], block["positions"][blockpos]], axis=1)
+                nearest = np.argsort(alldist, axis=1, kind="stable")[:, :k]
+
+                distance[rows] = np.take_along_axis(alldist, nearest, axis=1)
+                position[rows] = np.take_along_axis(allpos, nearest, axis=1)
+
+            nodes = nodes - (nodes & -nodes)
+
+    distance[position < 0] = np.nan
+
+    # distances returned are for unit sphere
+    return distance * EarthRadius, position
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  countamenities
+# DESCRIPTION:  Count the amenities within radius (km) of each (lat, long) pair (0 for points with missing coords)
+
+def countamenities(index, latitude, longitude, radius):
+    coords = np.deg2rad(np.column_stack([latitude, longitude]).astype(float))
+    valid = ~np.isnan(coords).any(axis=1)
+
+    counts = np.zeros(len(coords), dtype=int)
+
+    if valid.any():
+        counts[valid] = index["tree"].query_radius(coords[valid], r=radius / EarthRadius, count_only=True)
+
+    return counts
@@ -0,0 +1,89 @@
+from DATA9003 import assets
+
+# DATA HANDLING
+import os
+import numpy as np
+from importlib import resources
+
+from DATA9003.misc.projection import ProjectCoords
+
+
+# assets already loaded by this process: modification time of the asset file, loaded data & coord arrays
+_assetcache = {}
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  cachedasset
+# DESCRIPTION:  Get the cache entry for an asset file, loading it with reader on the first call
+#               The asset is reloaded if the file has changed (or doesn't exist) since it was last loaded
+
+def cachedasset(filename, reader):
+    with resources.path(assets, filename) as filepath:
+        mtime = os.path.getmtime(filepath) if os.path.exists(filepath) else None
+
+    entry = _assetcache.get(filename)
+
+    if (entry is None) or (mtime is None) or (entry["mtime"] != mtime):
+        data = reader()
+
+        # reading the asset may regenerate the file
+        with resources.path(assets, filename) as filepath:
+            mtime = os.path.getmtime(filepath) if os.path.exists(filepath) else None
+
+        entry = {"mtime": mtime,
+                 "data": data,
+                 "coords": {}}
+        _assetcache[filename] = entry
+
+    return entry
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadasset
+# DESCRIPTION:  Load an asset (see cachedasset), returning a copy so callers can change it without affecting the cache
+
+def loadasset(filename, reader):
+    return cachedasset(filename, reader)["data"].copy()
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array
+# NAME:  assetcoords
+# DESCRIPTION:  Get the (lat, long) coords of an asset (see cachedasset) as an (n, 2) array
+#               units = "degrees", "radians" (e.g. for haversine distances) or "feet" ((x, y) coords in EPSG:2263)
+#               Arrays are computed once per asset & units and are read only
+
+def assetcoords(filename, reader, units="radians"):
+    entry = cachedasset(filename, reader)
+
+    if units not in entry["coords"]:
+        latitude = entry["data"]["latitude"].values.astype(float)
+        longitude = entry["data"]["longitude"].values.astype(float)
+
+        if units == "degrees":
+            coords = np.column_stack([latitude, longitude])
+        elif units == "radians":
+            coords = np.deg2rad(np.column_stack([latitude, longitude]))
+        elif units == "feet":
+            coords = np.column_stack(ProjectCoords(latitude, longitude))
+        else:
+            raise ValueError("units should be 'degrees', 'radians' or 'feet' but is '{}'".format(units))
+
+        coords.flags.writeable = False
+        entry["coords"][units] = coords
+
+    return entry["coords"][units]
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  clearassets
+# DESCRIPTION:  Remove an asset (or all assets if filename is None) from the cache so it is reloaded on the next call
+
+def clearassets(filename=None):
+    if filename is None:
+        _assetcache.clear()
+    else:
+        _assetcache.pop(filename, None)
@@ -0,0 +1,378 @@
+from DATA9003 import assets
+
+# DATA HANDLING
+import os
+import time
+import pickle
+import difflib
+import threading
+import numpy as np
+import pandas as pd
+from importlib import resources
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from geopy.location import Location
+from geopy.geocoders import ArcGIS
+
+
+# abbreviations used by normaliseaddresses so "ST" and "STREET" (etc.) give the same address
+Abbreviations = {"STREET": "ST",
+                 "AVENUE": "AVE",
+                 "AV": "AVE",
+                 "BOULEVARD": "BLVD",
+                 "ROAD": "RD",
+                 "PLACE": "PL",
+                 "DRIVE": "DR",
+                 "LANE": "LN",
+                 "COURT": "CT",
+                 "PARKWAY": "PKWY",
+                 "TERRACE": "TER",
+                 "EXPRESSWAY": "EXPY",
+                 "HIGHWAY": "HWY",
+                 "SQUARE": "SQ",
+                 "NORTH": "N",
+                 "SOUTH": "S",
+                 "EAST": "E",
+                 "WEST": "W"}
+
+AbbreviationPattern = r"\b(" + "|".join(Abbreviations) + r")\b"
+
+# directionals & street types (after abbreviation) that must match exactly when fuzzy matching addresses
+Directionals = {"N", "S", "E", "W"}
+StreetTypes = set(Abbreviations.values()) - Directionals
+
+# index of geocoded property addresses, loaded once per process by addressindex
+_addressindex = None
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series
+# NAME:  normaliseaddresses
+# DESCRIPTION:  Convert addresses to a standard form (upper case, no punctuation or ordinal suffixes, abbreviated street types)
+#               e.g. "221 East 123rd Street" => "221 E 123 ST", missing addresses are left missing
+
+def normaliseaddresses(addresses):
+    addresses = pd.Series(addresses)
+    missing = addresses.isna()
+
+    addr = addresses.astype(str).str.upper()
+    addr = addr.str.replace(r"[.#']", " ", regex=True)
+    addr = addr.str.replace(r"\b(\d+)(ST|ND|RD|TH)\b", r"\1", regex=True)
+    addr = addr.str.replace(AbbreviationPattern, lambda match: Abbreviations[match.group(1)], regex=True)
+
+    # single spaces between words & no space before commas
+    addr = addr.str.replace(r"\s+", " ", regex=True).str.replace(" ,", ",").str.strip()
+
+    return addr.where(~missing)
+
+
+# OBJECT TYPE: Class
+# NAME:  TokenBucket
+# DESCRIPTION:  Rate limit shared by several threads: at most rate calls per second on average, with bursts of up to capacity calls
+
+class TokenBucket:
+    # steps to initialise a full bucket
+    def __init__(self, rate=10, capacity=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # function to wait until a token is available & take it
+    def acquire(self):
+        while True:
+            with self.lock:
+                # refill the bucket for the time since the last update
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# OBJECT TYPE: Class
+# NAME:  LocalGeocoder
+# DESCRIPTION:  Offline stand-in for a geopy geocoder (e.g. ArcGIS), so geocoding can be tested without network access
+#               Addresses are looked up in a DataFrame of known coords (address, latitude & longitude columns)
+#               Each call waits delay seconds to mimic a remote service, unknown addresses return None
+
+class LocalGeocoder:
+    # steps to initialise the geocoder from a table of known addresses
+    def __init__(self, known, address="address", delay=0):
+        keys = normaliseaddresses(known[address])
+        self.coords = dict(zip(keys, zip(known["latitude"], known["longitude"])))
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    # function to geocode a single address, returning a geopy Location (as a remote geocoder would) or None
+    def geocode(self, query):
+        with self.lock:
+            self.calls += 1
+
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        key = normaliseaddresses([query]).iloc[0]
+        if key not in self.coords:
+            return None
+
+        latitude, longitude = self.coords[key]
+        return Location(query, (latitude, longitude, 0.0), {})
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  readgeocache
+# DESCRIPTION:  Read the geocoding cache: {query: (lat, long)} (NaN coords for queries the geocoder couldn't find)
+
+def readgeocache(cachepath):
+    if not os.path.exists(cachepath):
+        return {}
+
+    cache = pd.read_csv(cachepath, dtype={"query": str})
+    cache = cache.drop_duplicates(subset="query", keep="last")
+
+    return dict(zip(cache["query"], zip(cache["latitude"], cache["longitude"])))
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: None
+# NAME:  writegeocache
+# DESCRIPTION:  Append geocoding results [(query, lat, long), ...] to the geocoding cache
+
+def writegeocache(cachepath, results):
+    if len(results) == 0:
+        return
+
+    pd.DataFrame(results, columns=["query", "latitude", "longitude"]).to_csv(cachepath,
+                                                                             mode="a",
+                                                                             header=not os.path.exists(cachepath),
+                                                                             index=False)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  geocodequeries
+# DESCRIPTION:  Get the (lat, long) coords of each query (address) using a persistent cache (the geocache.csv asset by default)
+#               Queries are normalised & deduplicated, only those not in the cache are sent to the geocoder
+#               The geocoder is sent the first original query for each normalised query (normalising is only used for matching)
+#               Queries are sent by a pool of worker threads, at most rate per second, and results are appended to
+#               the cache every checkpoint results so an interrupted run can carry on where it stopped
+#               Queries the geocoder couldn't find are cached (as NaN) & not retried, queries that raised errors are retried next run
+
+def geocodequeries(queries, cachepath=None, geocoder=None, workers=8, rate=10, checkpoint=50):
+    if cachepath is None:
+        with resources.path(assets, "geocache.csv") as filepath:
+            cachepath = str(filepath)
+
+    if geocoder is None:
+        geocoder = ArcGIS(user_agent="DATA9003")
+
+    keys = normaliseaddresses(queries)
+    cache = readgeocache(cachepath)
+    misses = [key for key in keys.dropna().unique() if key not in cache]
+
+    # original query sent to the geocoder for each normalised query
+    originals = pd.Series(pd.Series(queries).values, index=keys.values)
+    originals = originals[~originals.index.duplicated()]
+
+    bucket = TokenBucket(rate)
+
+    def geocode(key):
+        bucket.acquire()
+        return geocoder.geocode(originals[key])
+
+    results = []
+    failed = 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(geocode, key): key for key in misses}
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                location = future.result()
+            except Exception:
+                failed += 1
+                continue
+
+            if location is None:
+                cache[key] = (np.nan, np.nan)
+            else:
+                cache[key] = (location.latitude, location.longitude)
+            results.append((key,) + cache[key])
+
+            # checkpoint results
+            if len(results) >= checkpoint:
+                writegeocache(cachepath, results)
+                results = []
+    finally:
+        # if interrupted, drop queries not yet sent & keep the results received so far
+        pool.shutdown(wait=True, cancel_futures=True)
+        writegeocache(cachepath, results)
+
+    print("{} addresses: {} from cache, {} geocoded, {} failed".format(len(keys.dropna().unique()),
+                                                                      len(keys.dropna().unique()) - len(misses),
+                                                                      len(misses) - failed,
+                                                                      failed))
+
+    coords = [cache.get(key, (np.nan, np.nan)) for key in keys]
+
+    return pd.DataFrame(coords,
+                        index=keys.index,
+                        columns=["latitude", "longitude"])
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas Series
+# NAME:  addresskeys
+# DESCRIPTION:  Combine normalised addresses and zipcodes into keys ("221 E 123 ST|10035") for matching
+
+def addresskeys(addresses, zipcodes):
+    zipcodes = pd.to_numeric(pd.Series(zipcodes), errors="coerce").astype("Int64").astype(str)
+
+    return normaliseaddresses(addresses) + "|" + zipcodes.values
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Tuple
+# NAME:  streetparts
+# DESCRIPTION:  Split the street of an address key (without house number & zipcode) into (fixed, name) for fuzzy matching
+#               fixed is the tuple of numeric tokens, directionals & street types, name is the remaining words
+#               e.g. "1650 E 12 ST|11229" => (("E", "12", "ST"), "") & "524 WARWICK ST|11208" => (("ST",), "WARWICK")
+
+def streetparts(key):
+    street = key.split("|")[0].split(" ", 1)[1:]
+    tokens = street[0].replace(",", " ").split() if street else []
+
+    fixed = tuple(token for token in tokens
+                  if any(char.isdigit() for char in token) or (token in Directionals) or (token in StreetTypes))
+    name = " ".join(token for token in tokens
+                    if not (any(char.isdigit() for char in token) or (token in Directionals) or (token in StreetTypes)))
+
+    return fixed, name
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: String
+# NAME:  closestaddress
+# DESCRIPTION:  Get the candidate key closest to key, or None
+#               Candidates must have the same numbers, directionals & street type as key and only the street names are
+#               compared (difflib), the closest is used if its similarity is at least cutoff and more than margin above the next
+
+def closestaddress(key, candidates, cutoff=0.9, margin=0.05):
+    fixed, name = streetparts(key)
+
+    scores = []
+    for candidate in candidates:
+        candidatefixed, candidatename = streetparts(candidate)
+        if candidatefixed != fixed:
+            continue
+
+        scores.append((difflib.SequenceMatcher(None, name, candidatename).ratio(), candidate))
+
+    scores.sort(reverse=True)
+
+    if (len(scores) == 0) or (scores[0][0] < cutoff):
+        return None
+    if (len(scores) > 1) and (scores[0][0] - scores[1][0] <= margin):
+        return None
+
+    return scores[0][1]
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  addressindex
+# DESCRIPTION:  Load the index of geocoded property addresses (from PropertyCoords.csv) keyed by normalised address & zipcode
+#               Addresses are also grouped by zipcode & house number for fuzzy matching
+#               The index is saved as an asset & regenerated when it is older than PropertyCoords.csv
+
+def addressindex():
+    global _addressindex
+
+    with resources.path(assets, "PropertyCoords.csv") as coordfile:
+        coordtime = os.path.getmtime(coordfile)
+
+    if (_addressindex is None) or (_addressindex["sourcetime"] != coordtime):
+        with resources.path(assets, "addressindex.pkl") as filepath:
+            if os.path.exists(filepath) and (os.path.getmtime(filepath) >= coordtime):
+                with open(filepath, "rb") as indexfile:
+                    index = pickle.load(indexfile)
+            else:
+                with resources.path(assets, "PropertyCoords.csv") as coordfile:
+                    coords = pd.read_csv(coordfile,
+                                         usecols=["StreetAddress",
+                                                  "zipcode",
+                                                  "latitude",
+                                                  "longitude"])
+
+                coords["key"] = addresskeys(coords["StreetAddress"], coords["zipcode"]).values
+                coords = coords.dropna(subset=["latitude", "longitude"]).drop_duplicates(subset="key")
+
+                # candidates for fuzzy matching: addresses with the same zipcode and house number
+                blocks = coords["key"].str.split(" ", n=1).str[0] + "|" + coords["key"].str.split("|").str[1]
+
+                index = {"coords": coords.set_index("key")[["latitude", "longitude"]],
+                         "blocks": coords.groupby(blocks.values)["key"].agg(list).to_dict()}
+
+                with open(filepath, "wb") as indexfile:
+                    pickle.dump(index, indexfile)
+
+        index["sourcetime"] = coordtime
+        _addressindex = index
+
+    return _addressindex
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  matchaddresses
+# DESCRIPTION:  Get the (lat, long) coords of each (address, zipcode) pair from the address index
+#               Addresses are matched on their normalised form, those without an exact match are compared (closestaddress)
+#               to addresses with the same zipcode & house number and matched to the closest if it is a clear match
+#               The match column gives the type of match ("exact", "fuzzy" or missing) and the unmatched rate is printed
+
+def matchaddresses(addresses, zipcodes, index=None, cutoff=0.9, margin=0.05):
+    if index is None:
+        index = addressindex()
+
+    keys = addresskeys(addresses, zipcodes)
+
+    # exact matches
+    found = keys.isin(index["coords"].index).values
+    match = np.where(found, "exact", None)
+
+    # fuzzy matches (each unmatched key is only compared once)
+    fuzzy = {}
+    for key in keys[~found].dropna().unique():
+        block = key.split(" ", 1)[0] + "|" + key.split("|")[1]
+        closest = closestaddress(key, index["blocks"].get(block, []), cutoff=cutoff, margin=margin)
+        if closest is not None:
+            fuzzy[key] = closest
+
+    matched = keys.map(lambda key: fuzzy.get(key, key))
+    match[~found & keys.isin(list(fuzzy)).values] = "fuzzy"
+
+    # one join for all addresses
+    coords = index["coords"].reindex(matched.values)
+    coords.index = keys.index
+    coords["match"] = match
+
+    n_exact = (match == "exact").sum()
+    n_fuzzy = (match == "fuzzy").sum()
+    n_unmatched = len(match) - n_exact - n_fuzzy
+    print("{} addresses: {} exact matches, {} fuzzy matches, {} unmatched ({}%)".format(len(match),
+                                                                                      n_exact,
+                                                                                      n_fuzzy,
+                                                                                      n_unmatched,
+                                                                                      round(100 * n_unmatched / max(len(match), 1), 2)))
+
+    return coords
@@ -7,6 +7,7 @@ from shapely.geometry import shape
 import geopandas as gpd
 from sodapy import Socrata
 from importlib import resources
+from DATA9003.misc.assetcache import loadasset
 
 # PLOTTING
 import folium as fl
@@ -79,11 +80,11 @@ def getasset():
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
-# NAME:  loadparks
+# NAME:  readparks
 # DESCRIPTION:  Load the locations of parks in NYC from asset
 #               If an error occurs, load data using SODA and rewrite asset
 
-def loadparks():
+def readparks():
 
     try:
         with resources.path(assets, "parks.geojson") as filepath:
@@ -96,6 +97,15 @@ def loadparks():
     return parks
 
 
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadparks
+# DESCRIPTION:  Load the asset read by readparks, the asset is only re-read if the file has changed since the last call
+
+def loadparks():
+    return loadasset("parks.geojson", readparks)
+
+
 # OBJECT TYPE: Function
 # RETURN TYPE: Folium Map
 # NAME:  MapParks
@@ -0,0 +1,32 @@
+# DATA HANDLING
+import numpy as np
+from pyproj import Transformer
+
+
+# transform between lat/long (EPSG:4326) and the NY State Plane (EPSG:2263), distances in the projected coords are in ft
+ToFeet = Transformer.from_crs(4326, 2263, always_xy=True)
+FromFeet = Transformer.from_crs(2263, 4326, always_xy=True)
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array (x2)
+# NAME:  ProjectCoords
+# DESCRIPTION:  Convert (lat, long) coords to (x, y) coords in ft
+
+def ProjectCoords(latitude, longitude):
+    x, y = ToFeet.transform(np.asarray(longitude, dtype=float),
+                            np.asarray(latitude, dtype=float))
+
+    return x, y
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Numpy Array (x2)
+# NAME:  UnprojectCoords
+# DESCRIPTION:  Convert (x, y) coords in ft to (lat, long) coords
+
+def UnprojectCoords(x, y):
+    longitude, latitude = FromFeet.transform(np.asarray(x, dtype=float),
+                                             np.asarray(y, dtype=float))
+
+    return latitude, longitude
@@ -0,0 +1,162 @@
+from DATA9003 import assets
+
+# DATA HANDLING
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from importlib import resources
+
+
+# index of zipcode/census tract regions, built once per process by regionindex
+_regionindex = None
+
+# central coords of each census tract, loaded once per process by loadtractpoints
+_tractpoints = None
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: GeoPandas GeoDataFrame
+# NAME:  loadzipcodes
+# DESCRIPTION:  Load the GIS data for NYC zipcodes from asset
+
+def loadzipcodes():
+
+    with resources.path(assets, "zipcodes.zip") as zipfile:
+        zipcodes = gpd.read_file(zipfile)
+        zipcodes.columns = [name.lower() for name in zipcodes.columns]
+        zipcodes = zipcodes[["zipcode", "geometry"]]
+        zipcodes.to_crs(epsg=4326, inplace=True)
+
+    return zipcodes
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: GeoPandas GeoDataFrame
+# NAME:  loadtracts
+# DESCRIPTION:  Load the GIS data for NYC census tracts from asset
+
+def loadtracts():
+
+    with resources.path(assets, "censustracts.geojson") as censusfile:
+        census = gpd.read_file(censusfile)
+        census = census[["OBJECTID", "geometry"]]
+        census.to_crs(epsg=4326, inplace=True)
+
+    return census
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadtractpoints
+# DESCRIPTION:  Load a representative point (guaranteed to lie within the tract) for each census tract from asset
+#               If the asset is missing or older than the census tract GIS data then it is regenerated
+
+def loadtractpoints():
+    global _tractpoints
+
+    if _tractpoints is None:
+        with resources.path(assets, "censustracts.geojson") as censusfile:
+            censustime = os.path.getmtime(censusfile)
+
+        with resources.path(assets, "tractpoints.csv") as filepath:
+            if os.path.exists(filepath) and (os.path.getmtime(filepath) >= censustime):
+                tractpoints = pd.read_csv(filepath)
+            else:
+                census = loadtracts()
+                points = census.geometry.representative_point()
+
+                # get lat and long from GIS object
+                tractpoints = pd.DataFrame({"OBJECTID": census["OBJECTID"].values,
+                                            "latitude": points.y.values,
+                                            "longitude": points.x.values})
+                tractpoints.to_csv(filepath, index=False)
+
+        _tractpoints = tractpoints
+
+    return _tractpoints
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: GeoPandas GeoDataFrame
+# NAME:  loadregions
+# DESCRIPTION:  Load the intersections of each zipcode with each census tract from asset
+#               If the asset is missing or older than the zipcode/census tract GIS data then it is regenerated
+
+def loadregions():
+
+    with resources.path(assets, "zipcodes.zip") as zipfile:
+        ziptime = os.path.getmtime(zipfile)
+    with resources.path(assets, "censustracts.geojson") as censusfile:
+        censustime = os.path.getmtime(censusfile)
+    sourcetime = max(ziptime, censustime)
+
+    with resources.path(assets, "regions.geojson") as filepath:
+        if os.path.exists(filepath) and (os.path.getmtime(filepath) >= sourcetime):
+            regions = gpd.read_file(filepath)
+        else:
+            # a point lies within one of these regions only if it lies within both its zipcode and census tract
+            regions = gpd.overlay(loadtracts(),
+                                  loadzipcodes(),
+                                  how="intersection",
+                                  keep_geom_type=True)
+
+            regions = regions[["zipcode", "OBJECTID", "geometry"]]
+            regions.to_file(filepath, driver="GeoJSON")
+
+    return regions
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Dictionary
+# NAME:  regionindex
+# DESCRIPTION:  Get the spatial index of zipcode/census tract regions
+#               The index is built on the first call and reused by later calls
+
+def regionindex():
+    global _regionindex
+
+    if _regionindex is None:
+        regions = loadregions()
+
+        # prepare geometries once to speed up repeated point-in-polygon tests
+        geoms = np.asarray(regions.geometry)
+        shapely.prepare(geoms)
+
+        _regionindex = {"tree": shapely.STRtree(geoms),
+                        "zipcode": regions["zipcode"].values,
+                        "OBJECTID": regions["OBJECTID"].values}
+
+    return _regionindex
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  assignregions
+# DESCRIPTION:  Find the zipcode and census tract (OBJECTID) of each (lat, long) pair in a single pass
+#               Points outside every region (or with missing coords) are given NaN values
+
+def assignregions(latitude, longitude, index=None):
+    if index is None:
+        index = regionindex()
+
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+
+    # query the index for the region containing each point
+    points = shapely.points(longitude, latitude)
+    pointidx, regionidx = index["tree"].query(points, predicate="within")
+
+    # keep only the first match for any point found in more than one region
+    pointidx, first = np.unique(pointidx, return_index=True)
+    regionidx = regionidx[first]
+
+    zipcode = np.full(len(points), np.nan, dtype=object)
+    zipcode[pointidx] = index["zipcode"][regionidx]
+
+    tract = np.full(len(points), np.nan)
+    tract[pointidx] = index["OBJECTID"][regionidx]
+
+    return pd.DataFrame({"zipcode": zipcode,
+                         "OBJECTID": tract})
@@ -7,6 +7,7 @@ from shapely.geometry import shape
 import geopandas as gpd
 from sodapy import Socrata
 from importlib import resources
+from DATA9003.misc.assetcache import loadasset
 
 # PLOTTING
 import folium as fl
@@ -64,11 +65,11 @@ def getasset():
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
-# NAME:  loadschools
+# NAME:  readschools
 # DESCRIPTION:  Load the locations of schools in NYC from asset
 #               If an error occurs, load data using SODA and rewrite asset
 
-def loadschools():
+def readschools():
 
     try:
         with resources.path(assets, "schools.json") as filepath:
@@ -79,6 +80,15 @@ def loadschools():
     return schools
 
 
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadschools
+# DESCRIPTION:  Load the asset read by readschools, the asset is only re-read if the file has changed since the last call
+
+def loadschools():
+    return loadasset("schools.json", readschools)
+
+
 # OBJECT TYPE: Function
 # RETURN TYPE: Folium Map
 # NAME:  mapschools
@@ -4,6 +4,7 @@ import geopandas as gpd
 from sodapy import Socrata
 import wikipedia as wp
 from importlib import resources
+from DATA9003.misc.assetcache import loadasset
 from shapely.geometry import shape
 from shapely.geometry import Point
 import re
@@ -126,10 +127,10 @@ def getasset():
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
-# NAME:  loadstations
+# NAME:  readstations
 # DESCRIPTION:  read station coords from file or generate new file
 
-def loadstations():
+def readstations():
 
     try:
         with resources.path(assets, "transport_hubs.geojson") as filepath:
@@ -142,6 +143,15 @@ def loadstations():
     return hubs
 
 
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadstations
+# DESCRIPTION:  Load the asset read by readstations, the asset is only re-read if the file has changed since the last call
+
+def loadstations():
+    return loadasset("transport_hubs.geojson", readstations)
+
+
 # OBJECT TYPE: Function
 # RETURN TYPE: folium map
 # NAME:  mapstations
@@ -6,6 +6,7 @@ from sodapy import Socrata
 import json
 from shapely.geometry import shape
 from importlib import resources
+from DATA9003.misc.assetcache import loadasset
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
@@ -54,11 +55,11 @@ def getasset():
 
 # OBJECT TYPE: Function
 # RETURN TYPE: Pandas DataFrame
-# NAME:  loadschools
+# NAME:  readthirdlvl
 # DESCRIPTION:  Load the locations of universities/colleges in NYC from asset
 #               If an error occurs, load data using SODA and rewrite asset
 
-def loadthirdlvl():
+def readthirdlvl():
 
     try:
         with resources.path(assets, "thirdlevel.csv") as filepath:
@@ -66,4 +67,13 @@ def loadthirdlvl():
     except:
         unis = getasset()
 
-    return unis
\ No newline at end of file
+    return unis
+
+
+# OBJECT TYPE: Function
+# RETURN TYPE: Pandas DataFrame
+# NAME:  loadthirdlvl
+# DESCRIPTION:  Load the asset read by readthirdlvl, the asset is only re-read if the file has changed since the last call
+
+def loadthirdlvl():
+    return loadasset("thirdlevel.csv", readthirdlvl)
\ No newline at end of file
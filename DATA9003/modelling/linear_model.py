@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
-import statsmodels.api as sm
+from scipy import stats
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 
@@ -33,6 +33,26 @@ def TrainTest(X, y, t):
 
     return X_train, X_test, y_train, y_test, t_train, t_test
 
+def PseudoInverse(A, rcond=1e-10):
+    # pseudo-inverse and rank of a symmetric positive semi-definite matrix (e.g. X'X)
+    # the rank is found after scaling A to unit diagonal, so columns measured on very different scales aren't mistaken for
+    # collinear columns, and the result is projected onto the range of A so it is the Moore-Penrose inverse of A itself
+    d = np.sqrt(np.diag(A))
+    d[d == 0] = 1
+    D = np.diag(1 / d)
+
+    w, V = np.linalg.eigh(D @ A @ D)
+    keep = w > rcond * max(w.max(), 0)
+
+    # generalised inverse of A & basis of the null space of A
+    G = D @ (V[:, keep] / w[keep]) @ V[:, keep].T @ D
+    N = D @ V[:, ~keep]
+
+    # project onto the range of A
+    P = np.eye(len(A)) - N @ np.linalg.solve(N.T @ N, N.T)
+
+    return P @ G @ P, int(keep.sum())
+
 class RollingRegression:
     # steps to initialise an instance of the Rolling Regression Model
     def __init__(self, X, y, t):
@@ -64,30 +84,80 @@ class RollingRegression:
         self.Fstat = np.zeros(n_windows)
 
     # function to fit the RR model
+    # each window is fitted from the sufficient statistics (X'X, X'y, y'y, sum of y & n) of its quarters, so the data is
+    # only read once & moving the window adds the statistics of the quarters entering it and subtracts those leaving it
     def fit(self):
-        # indices
-        idx = 0
+        X = np.asarray(self.data, dtype=float)
+        y = np.asarray(self.response, dtype=float)
+        n_endog = X.shape[1]
+
+        # number the quarters in order of appearance
+        q_idx, quarters = pd.factorize(self.time)
+        n_quarters = len(quarters)
+
+        # sufficient statistics for each quarter
+        XtX = np.zeros((n_quarters, n_endog, n_endog))
+        Xty = np.zeros((n_quarters, n_endog))
+        yty = np.zeros(n_quarters)
+        ysum = np.zeros(n_quarters)
+        nobs = np.bincount(q_idx, minlength=n_quarters)
+
+        order = np.argsort(q_idx, kind="stable")
+        bounds = np.searchsorted(q_idx[order], np.arange(n_quarters + 1))
+        for q in range(n_quarters):
+            rows = order[bounds[q]:bounds[q + 1]]
+            XtX[q] = X[rows].T @ X[rows]
+            Xty[q] = X[rows].T @ y[rows]
+            yty[q] = y[rows] @ y[rows]
+            ysum[q] = y[rows].sum()
+
+        # statistics of the first window
         lwr = 0
         upr = self.window
+        S_XtX = XtX[lwr:upr].sum(axis=0)
+        S_Xty = Xty[lwr:upr].sum(axis=0)
+        S_yty = yty[lwr:upr].sum()
+        S_ysum = ysum[lwr:upr].sum()
+        S_n = nobs[lwr:upr].sum()
+
+        self.cov = np.zeros((len(self.coeffs), n_endog, n_endog))
+        self.windows = []
 
-        # iterate through the data set
-        while upr <= len(self.time.unique()):
-            window = list(self.time.unique())[lwr:upr]
+        idx = 0
+        while upr <= n_quarters:
+            # least squares solution (minimum norm if X'X is singular, as statsmodels OLS)
+            XtX_inv, rank = PseudoInverse(S_XtX)
+            beta = XtX_inv @ S_Xty
 
-            # filter for data in the current windoe
-            x_window = self.data.loc[self.time.isin(window), :]
-            y_window = self.response.loc[self.time.isin(window)]
+            # sums of squares (model includes a constant)
+            ssr = max(S_yty - beta @ S_Xty, 0)
+            centered_tss = S_yty - S_ysum ** 2 / S_n
+            df_resid = S_n - rank
+            df_model = rank - 1
 
-            # fit a linear regression model to the window
-            model_window = sm.OLS(y_window, x_window, hasconst=True)
-            res_window = model_window.fit()
+            # standard errors & p-values of the coefficients
+            scale = ssr / df_resid
+            self.cov[idx] = scale * XtX_inv
+            bse = np.sqrt(np.diag(self.cov[idx]))
+            tvals = beta / bse
 
             # add the coefficients and evaluation metrics to the relevant arrays
-            self.coeffs[idx] = np.array(res_window.params)
-            self.pvals[idx] = np.array(res_window.pvalues)
-            self.Fstat[idx] = np.array(res_window.fvalue)
-            self.Rsq[idx] = np.array(res_window.rsquared)
-            self.Rsq_adj[idx] = np.array(res_window.rsquared_adj)
+            self.coeffs[idx] = beta
+            self.pvals[idx] = 2 * stats.t.sf(np.abs(tvals), df_resid)
+            self.Rsq[idx] = 1 - ssr / centered_tss
+            self.Rsq_adj[idx] = 1 - (S_n - 1) / df_resid * (1 - self.Rsq[idx])
+            self.Fstat[idx] = ((centered_tss - ssr) / df_model) / scale
+            self.windows.append(quarters[upr - 1])
+
+            # move the window: add the quarters entering it & subtract the quarters leaving it
+            entering = slice(upr, min(upr + self.stepsize, n_quarters))
+            leaving = slice(lwr, lwr + self.stepsize)
+
+            S_XtX = S_XtX + XtX[entering].sum(axis=0) - XtX[leaving].sum(axis=0)
+            S_Xty = S_Xty + Xty[entering].sum(axis=0) - Xty[leaving].sum(axis=0)
+            S_yty = S_yty + yty[entering].sum() - yty[leaving].sum()
+            S_ysum = S_ysum + ysum[entering].sum() - ysum[leaving].sum()
+            S_n = S_n + nobs[entering].sum() - nobs[leaving].sum()
 
             # update indices
             lwr = lwr + self.stepsize
@@ -101,24 +171,28 @@ class RollingRegression:
                                   columns=self.data.columns)
 
     # function to predict the sale price of new observations using the fitted model
-    def predict(self, X, t):
-        # initialise array for output
-        ypred = np.zeros(len(X))
-
-        # iterate through the observations by index
-        for i in range(len(X)):
-            # get the attribute values
-            obs_i = np.array(X.iloc[i, :])
-
-            # get the relevant coefficients for the time
-            # any quarters before Q4-2006 use the coeffs for Q4-2006
-            if t.iloc[i] <= 3:
-                beta = self.coeffs.iloc[0, :]
-            else:
-                beta = self.coeffs.iloc[t.iloc[i] - 4, :]
-
-            # calculate the estimate for this observation
-            ypred[i] = np.dot(obs_i, beta)
+    # each observation uses the coefficients of the window ending in its quarter (the first window containing it)
+    # quarters before the first window use the first window (e.g. Q4-2006) & quarters after the last window use the last window
+    # if return_se the standard error of each prediction (sqrt(x' Cov x)) is also returned
+    def predict(self, X, t, return_se=False):
+        X = np.asarray(X, dtype=float)
+        t = np.asarray(t)
+
+        # last quarter of each window in time order
+        ends = np.asarray(self.windows)
+        order = np.argsort(ends, kind="stable")
+
+        # index of the window for each observation, clipped to the fitted windows
+        pos = np.searchsorted(ends[order], t, side="left")
+        pos = np.clip(pos, 0, len(ends) - 1)
+        idx = order[pos]
+
+        # calculate the estimates for all observations at once
+        ypred = np.einsum("ij,ij->i", X, self.coeffs.values[idx])
+
+        if return_se:
+            se = np.sqrt(np.einsum("ij,ijk,ik->i", X, self.cov[idx], X))
+            return ypred, se
 
         return ypred
 